@@ -0,0 +1,308 @@
+# See LICENSE for details
+"""Benchmarks for the python hot paths of river_core.
+
+Runs against synthetic artifacts only, so neither simulators nor the RISC-V
+toolchain are needed. Results are written as JSON and can be checked against
+a previous run to catch regressions in framework throughput.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import datetime
+import tempfile
+import statistics
+from multiprocessing import Pool
+
+import click
+
+# The repository is put before an installed river_core, so that the tree
+# checked out is benchmarked without installing it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+import synthetic
+from river_core.log import logger
+from river_core.__init__ import __version__
+import river_core.utils as utils
+import river_core.rivercore as rivercore
+import river_core.status as status
+
+#: Data sizes for each benchmark: records per dump, words per signature,
+#: tests in a test list and tests compared under the Pool.
+sizes = {
+    'small': {
+        'dump_lines': 10000,
+        'signature_words': 10000,
+        'test_list': 500,
+        'pool_tests': 16,
+        'pool_dump_lines': 2000
+    },
+    'medium': {
+        'dump_lines': 200000,
+        'signature_words': 200000,
+        'test_list': 5000,
+        'pool_tests': 64,
+        'pool_dump_lines': 10000
+    },
+    'large': {
+        'dump_lines': 2000000,
+        'signature_words': 2000000,
+        'test_list': 50000,
+        'pool_tests': 256,
+        'pool_dump_lines': 20000
+    },
+}
+
+report_config = {
+    'river_core': {
+        'isa': 'rv64imafdc',
+        'target': 'chromite_verilator',
+        'reference': 'spike',
+        'generator': 'aapg'
+    }
+}
+
+
+def measure(func, repeat, *args):
+    '''
+        Function to time a callable.
+
+        :param func: Callable to time
+
+        :param repeat: Number of times the callable is run
+
+        :type func: callable
+
+        :type repeat: int
+
+        :return: Min, median and max wall-clock times in seconds
+
+        :rtype: dict
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'runs': repeat
+    }
+
+
+def bench_dumps(scratch, size, repeat):
+    lines = size['dump_lines']
+    dut = synthetic.write_dump(scratch + '/dut.dump', lines, seed=1)
+    ref = synthetic.write_dump(scratch + '/ref.dump', lines, seed=1)
+    bad = synthetic.write_dump(scratch + '/bad.dump',
+                               lines,
+                               seed=1,
+                               mismatch_at=lines // 2)
+
+    def uncached(func, *args):
+        # The line counts and digests are cached per file, time the first
+        # count and digest
+        utils._line_counts.clear()
+        for dump in (dut, ref, bad):
+            if os.path.exists(dump + utils.digest_suffix):
+                os.remove(dump + utils.digest_suffix)
+        return func(*args)
+
+    results = {
+        'compare_dumps_pass':
+        measure(uncached, repeat, utils.compare_dumps, dut, ref),
+        'compare_dumps_fail':
+        measure(uncached, repeat, utils.compare_dumps, bad, ref),
+        'dump_digest':
+        measure(uncached, repeat, utils.dump_digest, dut),
+        'get_file_size': measure(uncached, repeat, utils.get_file_size, dut),
+        'count_lines_cached': measure(utils.count_lines, repeat, dut),
+        'last_line': measure(status.last_line, repeat, dut),
+    }
+    # Dumps saved with their digests are compared by the digests
+    utils.dump_digest(dut)
+    utils.dump_digest(ref)
+    results['compare_dumps_digest'] = measure(utils.compare_dumps, repeat, dut,
+                                              ref)
+    return results
+
+
+def bench_self_check(scratch, size, repeat):
+    words = size['signature_words']
+    passing = synthetic.write_signature(scratch + '/pass.signature', words)
+    failing = synthetic.write_signature(scratch + '/fail.signature',
+                                        words,
+                                        fail_at=words // 2)
+    return {
+        'self_check_pass': measure(utils.self_check, repeat, passing),
+        'self_check_fail': measure(utils.self_check, repeat, failing),
+    }
+
+
+def bench_logcomparison(scratch, size, repeat, nproc):
+    items = []
+    for num in range(size['pool_tests']):
+        test = 'test_{0:05d}'.format(num)
+        # every eighth test fails midway
+        mismatch = size['pool_dump_lines'] // 2 if num % 8 == 7 else None
+        test_dir = synthetic.make_test_dir(scratch + '/pool', test,
+                                           size['pool_dump_lines'], mismatch)
+        items.append((test, {'work_dir': test_dir, 'self_checking': False}))
+
+    def pooled():
+        logger.start_queue()
+        with Pool(processes=nproc) as process_pool:
+            process_pool.map(rivercore.logcomparison, items)
+
+    return {'logcomparison_pool': measure(pooled, repeat)}
+
+
+def bench_test_list(scratch, size, repeat):
+    test_list = synthetic.make_test_list(scratch, size['test_list'])
+    test_list_file = scratch + '/test_list.yaml'
+    with open(test_list_file, 'w') as outfile:
+        utils.yaml.dump(test_list, outfile)
+
+    def validate():
+        rivercore.validate_test_list(
+            {test: dict(fields) for test, fields in test_list.items()})
+
+    results = {
+        'validate_test_list': measure(validate, repeat),
+        'load_yaml': measure(utils.load_yaml, repeat, test_list_file),
+    }
+    try:
+        results['save_yaml'] = measure(utils.save_yaml, repeat, test_list,
+                                       scratch + '/saved.yaml')
+    except Exception as err:
+        results['save_yaml'] = {'error': repr(err)}
+    return results
+
+
+def bench_report(scratch, size, repeat):
+    test_dict = synthetic.make_test_list(scratch, size['test_list'])
+    for num, test in enumerate(test_dict):
+        test_dict[test]['result'] = 'Failed' if num % 8 == 7 else 'Passed'
+        test_dict[test]['log'] = 'diff output\n' * 4
+        test_dict[test]['num_instr'] = size['pool_dump_lines']
+    json_data = {
+        stage: synthetic.make_pytest_json(test_dict, stage)
+        for stage in ('generator', 'target', 'reference')
+    }
+
+    def report():
+        rivercore.generate_report(scratch + '/report', json_data['generator'],
+                                  json_data['target'], json_data['reference'],
+                                  report_config, test_dict)
+
+    return {'generate_report': measure(report, repeat)}
+
+
+def check_baseline(results, baseline_file, threshold):
+    '''
+        Function to compare the results against a previous run.
+
+        :param results: Results of the current run
+
+        :param baseline_file: JSON results of a previous run
+
+        :param threshold: Allowed slowdown factor of the median time
+
+        :type results: dict
+
+        :type baseline_file: str
+
+        :type threshold: float
+
+        :return: Names of the benchmarks which regressed
+
+        :rtype: list
+    '''
+    with open(baseline_file, 'r') as infile:
+        baseline = json.load(infile)['results']
+    regressed = []
+    for name, result in results.items():
+        if 'median' not in result or 'median' not in baseline.get(name, {}):
+            continue
+        ratio = result['median'] / max(baseline[name]['median'], 1e-9)
+        if ratio > threshold:
+            click.echo('{0:<25} : {1:.2f}x slower than baseline'.format(
+                name, ratio))
+            regressed.append(name)
+    return regressed
+
+
+@click.command()
+@click.option('--size',
+              type=click.Choice(list(sizes.keys())),
+              default='small',
+              help='Size of the synthetic data')
+@click.option('--repeat', default=3, help='Number of runs per benchmark')
+@click.option('--nproc',
+              default=4,
+              help='Number of processes for the Pool benchmarks')
+@click.option('--output',
+              default='benchmark_results.json',
+              type=click.Path(dir_okay=False),
+              help='JSON file to save the results')
+@click.option('--baseline',
+              default=None,
+              type=click.Path(dir_okay=False, exists=True),
+              help='JSON results of a previous run to compare against')
+@click.option('--threshold',
+              default=1.25,
+              help='Allowed slowdown against the baseline before failing')
+@click.option('--keep', is_flag=True, help='Keep the synthetic data')
+def main(size, repeat, nproc, output, baseline, threshold, keep):
+    '''
+        Run the river_core benchmarks.
+    '''
+    logger.level('critical')
+    scratch = tempfile.mkdtemp(prefix='river_core_bench_')
+    results = {}
+    try:
+        for bench in (bench_dumps, bench_self_check, bench_test_list,
+                      bench_report):
+            bench_dir = os.path.join(scratch, bench.__name__)
+            os.makedirs(bench_dir)
+            results.update(bench(bench_dir, sizes[size], repeat))
+        bench_dir = os.path.join(scratch, 'bench_logcomparison')
+        os.makedirs(bench_dir)
+        results.update(
+            bench_logcomparison(bench_dir, sizes[size], repeat, nproc))
+    finally:
+        if keep:
+            click.echo('Synthetic data kept at {0}'.format(scratch))
+        else:
+            shutil.rmtree(scratch)
+
+    data = {
+        'river_core': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'size': size,
+        'sizes': sizes[size],
+        'results': results
+    }
+    with open(output, 'w') as outfile:
+        json.dump(data, outfile, indent=2)
+
+    for name, result in results.items():
+        if 'median' in result:
+            click.echo('{0:<25} : {1:10.4f} s'.format(name, result['median']))
+        else:
+            click.echo('{0:<25} : {1}'.format(name, result['error']))
+    click.echo('Results saved at {0}'.format(output))
+
+    if baseline and check_baseline(results, baseline, threshold):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# See LICENSE for details
+"""Synthetic artifacts (commit-log dumps, signatures, test lists) for the benchmarks"""
+import os
+import zlib
+import random
+
+# Same layout as the commit logs matched by river_core.utils.dump_regex
+dump_line = 'core   0: 3 0x{pc:016x} (0x{instr:08x}) x{rd:<2} 0x{value:016x}\n'
+store_line = 'core   0: 3 0x{pc:016x} (0x{instr:08x}) mem 0x{addr:016x} 0x{value:016x}\n'
+
+
+def write_dump(path, num_lines, seed=0, mismatch_at=None):
+    '''
+        Function to write a synthetic commit-log dump.
+
+        :param path: Path of the dump to write
+
+        :param num_lines: Number of records in the dump
+
+        :param seed: Seed for the random values in the dump
+
+        :param mismatch_at: Record number whose register value is corrupted, None for no mismatch
+
+        :type path: str
+
+        :type num_lines: int
+
+        :type seed: int
+
+        :type mismatch_at: int
+
+        :return: Path of the dump
+
+        :rtype: str
+    '''
+    rand = random.Random(seed)
+    pc = 0x80000000
+    lines = []
+    with open(path, 'w') as dump:
+        for lineno in range(num_lines):
+            instr = rand.getrandbits(32) | 0x3
+            value = rand.getrandbits(64)
+            if lineno == mismatch_at:
+                value ^= 0x1
+            if lineno % 10 == 9:
+                lines.append(
+                    store_line.format(pc=pc,
+                                      instr=instr,
+                                      addr=0x80001000 + (lineno % 512) * 8,
+                                      value=value))
+            else:
+                lines.append(
+                    dump_line.format(pc=pc,
+                                     instr=instr,
+                                     rd=1 + lineno % 31,
+                                     value=value))
+            pc += 4
+            if len(lines) == 4096:
+                dump.writelines(lines)
+                lines = []
+        dump.writelines(lines)
+    return path
+
+
+def write_signature(path, num_words, fail_at=None):
+    '''
+        Function to write a synthetic signature of a self-checking test.
+
+        :param path: Path of the signature to write
+
+        :param num_words: Number of words in the signature
+
+        :param fail_at: Word which is set to a non-zero value, None for a passing signature
+
+        :type path: str
+
+        :type num_words: int
+
+        :type fail_at: int
+
+        :return: Path of the signature
+
+        :rtype: str
+    '''
+    with open(path, 'w') as signature:
+        for word in range(num_words):
+            signature.write('00000001\n' if word == fail_at else '00000000\n')
+    return path
+
+
+def make_test_dir(work_dir, test, num_lines, mismatch_at=None,
+                  self_checking=False):
+    '''
+        Function to create the work_dir of a test with the artifacts that the
+        compare stage looks for.
+
+        :param work_dir: Root directory of the synthetic regression
+
+        :param test: Name of the test
+
+        :param num_lines: Number of records in the dumps
+
+        :param mismatch_at: Record number where the DuT dump diverges, None for a passing test
+
+        :param self_checking: Create a signature instead of a reference dump
+
+        :type work_dir: str
+
+        :type test: str
+
+        :type num_lines: int
+
+        :type mismatch_at: int
+
+        :type self_checking: bool
+
+        :return: The work_dir of the test
+
+        :rtype: str
+    '''
+    test_dir = os.path.join(work_dir, test)
+    os.makedirs(test_dir, exist_ok=True)
+    seed = zlib.crc32(test.encode())
+    write_dump(os.path.join(test_dir, 'dut.dump'), num_lines, seed,
+               mismatch_at)
+    if self_checking:
+        write_signature(os.path.join(test_dir, 'dut.signature'), 64)
+    else:
+        write_dump(os.path.join(test_dir, 'ref.dump'), num_lines, seed)
+    return test_dir
+
+
+def make_test_list(work_dir, num_tests, generator='aapg'):
+    '''
+        Function to create a test list following the test list schema. All the
+        tests share a single asm/linker file and work_dir so that large lists
+        can be created cheaply.
+
+        :param work_dir: Directory where the shared collaterals are created
+
+        :param num_tests: Number of tests in the test list
+
+        :param generator: Name of the generator set in each test
+
+        :type work_dir: str
+
+        :type num_tests: int
+
+        :type generator: str
+
+        :return: The test list
+
+        :rtype: dict
+    '''
+    common = os.path.join(work_dir, 'common')
+    os.makedirs(common, exist_ok=True)
+    asm_file = os.path.join(common, 'test.S')
+    linker_file = os.path.join(common, 'link.ld')
+    crt_file = os.path.join(common, 'crt.S')
+    for path in (asm_file, linker_file, crt_file):
+        with open(path, 'w') as collateral:
+            collateral.write('\n')
+    test_list = {}
+    for num in range(num_tests):
+        test = '{0}_rv64imafdc_hazards_s_{1:06d}'.format(generator, num)
+        test_list[test] = {
+            'asm_file': asm_file,
+            'cc': 'riscv64-unknown-elf-gcc',
+            'cc_args': '-mcmodel=medany -static -std=gnu99 -O2',
+            'compile_macros': ['XLEN=64'],
+            'extra_compile': [crt_file],
+            'generator': generator,
+            'include': [common],
+            'isa': 'rv64imafdc',
+            'linker_args': '-static -nostdlib -nostartfiles -lm -lgcc -T',
+            'linker_file': linker_file,
+            'mabi': 'lp64',
+            'march': 'rv64imafdc',
+            'result': 'Unavailable',
+            'work_dir': common
+        }
+    return test_list
+
+
+def make_pytest_json(test_list, stage):
+    '''
+        Function to create the rows of a pytest report-log as written by the
+        plugins through ``--report-log``.
+
+        :param test_list: Test list whose tests are reported
+
+        :param stage: Name of the plugin stage that is reported
+
+        :type test_list: dict
+
+        :type stage: str
+
+        :return: Rows of the report log
+
+        :rtype: list
+    '''
+    rows = [{'$report_type': 'SessionStart', 'pytest_version': '6.2.5'}]
+    for test in test_list:
+        nodeid = '{0}/gen_framework.py::test_eval[{1}]'.format(stage, test)
+        for when in ('setup', 'call', 'teardown'):
+            rows.append({
+                '$report_type': 'TestReport',
+                'nodeid': nodeid,
+                'location': ['gen_framework.py', 60, 'test_eval'],
+                'keywords': {test: 1, 'test_eval': 1},
+                'outcome': 'passed',
+                'longrepr': None,
+                'when': when,
+                'user_properties': [],
+                'sections': [['Captured log setup', ''],
+                             ['Captured log call',
+                              'make -f Makefile {0}\n'.format(test) * 8]],
+                'duration': 1.5,
+            })
+    rows.append({'$report_type': 'SessionFinish', 'exitstatus': 0})
+    return rows
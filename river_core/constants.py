@@ -66,9 +66,30 @@ include:
 ignore_lines:
     type: integer
     default: 4
+compare_skip:
+  type: dict
+  nullable: True
+  default: null
+  schema:
+    dut_head:
+      type: integer
+      min: 0
+    dut_tail:
+      type: integer
+      min: 0
+    ref_head:
+      type: integer
+      min: 0
+    ref_tail:
+      type: integer
+      min: 0
 self_checking:
   type: boolean
   default: False
+timeout:
+  type: integer
+  nullable: True
+  min: 1
 ''' #: This contains the schema for validation
 
 sample_config = '''
@@ -100,6 +121,14 @@ open_browser = True
 # Enable Space Saver
 space_saver = True
 
+# SQLite database of the durations of earlier runs, which orders the tests
+# longest first and sets their timeouts. Defaults to history.db in the work_dir
+# history_db = ~/.river_core/history.db
+
+# Run the reference plugins first, so that the DuT plugins can stop the tests
+# at their first divergence from the reference dumps
+# kill_on_divergence = True
+
 # Coverage Options
 # Enable via True/False
 [coverage]
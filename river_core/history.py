@@ -0,0 +1,479 @@
+# See LICENSE for details
+"""History of the durations of earlier runs, kept in an SQLite database"""
+import os
+import re
+import sys
+import math
+import time
+import sqlite3
+from urllib.request import pathname2url
+from river_core.log import logger
+import river_core.shard as sharding
+from river_core.__init__ import __version__
+
+#: Database in the work_dir, unless history_db is set in the river_core
+#: section of the config. The locks of SQLite are not reliable on network
+#: filesystems, so a database is written by one host at a time: the shards of
+#: a run write their own, which river_core collect merges.
+history_file = 'history.db'
+
+#: Number of recent durations of a test used for the estimates
+recent_runs = 20
+
+#: Number of durations of a test needed before its timeout is set
+min_runs = 3
+
+#: Least timeout in seconds set for a test
+min_timeout = 60
+
+#: Factor by which the DuT must simulate a test slower than the median of the
+#: earlier runs to be flagged
+slowdown = 1.5
+
+#: Runs kept in the database, older durations are removed
+keep_runs = 200
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    version TEXT,
+    command TEXT
+);
+CREATE TABLE IF NOT EXISTS durations (
+    run INTEGER,
+    stage TEXT,
+    test TEXT,
+    generator TEXT,
+    seconds REAL,
+    num_instr INTEGER
+);
+CREATE INDEX IF NOT EXISTS durations_stage ON durations (stage, test, run);
+'''
+
+# Parts of a pytest node id, one of which names the test
+_token_regex = re.compile(r'[^\s/\[\]:=,\'"]+')
+
+
+def history_path(config, shard=None):
+    '''
+        Function to find the history database of a config.
+
+        :param config: The river_core config
+
+        :param shard: K and N of the shard, whose own database is found
+
+        :type config: configparser.ConfigParser
+
+        :type shard: tuple
+
+        :return: Path of the database
+
+        :rtype: str
+    '''
+    path = config['river_core'].get('history_db', '').strip()
+    if not path:
+        path = os.path.join(config['river_core']['work_dir'], history_file)
+    return sharding.shard_file(os.path.expanduser(path), shard)
+
+
+def open_history(config, command, shard=None):
+    '''
+        Function to open the history database of a config and start a run.
+        A shard reads the durations of the earlier runs from the database of
+        the config, and records its own in the database of the shard.
+
+        :param config: The river_core config
+
+        :param command: The river_core command of the run
+
+        :param shard: K and N of the shard
+
+        :type config: configparser.ConfigParser
+
+        :type command: str
+
+        :type shard: tuple
+
+        :return: The history, None when the database cannot be opened
+
+        :rtype: History
+    '''
+    path = history_path(config)
+    try:
+        history = History(path, history_path(config, shard))
+        history.start(command)
+    except (sqlite3.Error, OSError) as error:
+        logger.warning('History database {0} is not available: {1}'.format(
+            path, error))
+        return None
+    return history
+
+
+def median(values):
+    '''
+        Function to find the median of values.
+
+        :param values: The values
+
+        :type values: list
+
+        :rtype: float
+    '''
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def percentile(values, fraction):
+    '''
+        Function to find a percentile of values by the nearest rank.
+
+        :param values: The values
+
+        :param fraction: The percentile, like 0.99
+
+        :type values: list
+
+        :type fraction: float
+
+        :rtype: float
+    '''
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def plugin_durations(json_data, tests):
+    '''
+        Function to find the duration of each test from the pytest report log
+        of a plugin, as the sum of the setup, call and teardown of the pytest
+        tests whose node id names the test.
+
+        :param json_data: Sanitised pytest JSON of the plugin
+
+        :param tests: Names of the tests
+
+        :type json_data: list
+
+        :type tests: dict
+
+        :return: Seconds taken by each test
+
+        :rtype: dict
+    '''
+    durations = {}
+    for row in json_data or []:
+        duration = row.get('duration')
+        if not isinstance(duration, (int, float)):
+            continue
+        test = None
+        for token in reversed(_token_regex.findall(row.get('nodeid') or '')):
+            for name in (token, os.path.splitext(token)[0]):
+                if name in tests:
+                    test = name
+                    break
+            if test is not None:
+                break
+        if test is not None:
+            durations[test] = durations.get(test, 0) + duration
+    return durations
+
+
+class History():
+    '''
+        Durations and instruction counts of the tests in earlier runs. Each
+        stage of a run is recorded with the seconds each test took:
+
+        * ``generate``: a generator plugin, without a test
+        * ``dut``, ``ref``: the DuT and reference plugins, which compile and
+          simulate each test in one pytest test
+        * ``compare``: the compare of the dumps
+
+        :param path: Path of the database of the earlier runs
+
+        :param record_path: Path of the database the run is recorded in, by
+            default the database of the earlier runs. It is created when
+            missing.
+
+        :type path: str
+
+        :type record_path: str
+    '''
+
+    def __init__(self, path, record_path=None):
+        self.path = path
+        self.record_path = record_path or path
+        directory = os.path.dirname(os.path.abspath(self.record_path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.record_path, timeout=60)
+        self.connection.executescript(_schema)
+        self.reader = self.connection
+        if self.record_path != path:
+            self.reader = None
+            if os.path.exists(path):
+                # No host writes the database of the config while the shards
+                # run, so it is read without locks
+                self.reader = sqlite3.connect('file:{0}?mode=ro&immutable=1'.format(
+                    pathname2url(os.path.abspath(path))),
+                                              uri=True)
+        self.run = None
+        # Durations read so far, of each stage and test
+        self._samples = {}
+
+    def start(self, command):
+        '''
+            Function to add a run, which the durations recorded next belong to.
+
+            :param command: The river_core command of the run
+
+            :type command: str
+        '''
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (date, version, command) VALUES (?, ?, ?)',
+                (time.strftime('%Y-%m-%d %H:%M:%S'), __version__, command))
+            self.run = cursor.lastrowid
+            self.connection.execute('DELETE FROM durations WHERE run <= ?',
+                                    (self.run - keep_runs,))
+
+    def record(self, stage, durations, test_dict=None, generator=None):
+        '''
+            Function to record the durations of a stage of the run.
+
+            :param stage: The stage, like dut
+
+            :param durations: Seconds taken by each test, or by the stage with
+                the test None
+
+            :param test_dict: The test list, for the generator and number of
+                instructions of the tests
+
+            :param generator: The generator, when not in the test list
+
+            :type stage: str
+
+            :type durations: dict
+
+            :type test_dict: dict
+
+            :type generator: str
+        '''
+        test_dict = test_dict or {}
+        rows = []
+        for test, seconds in durations.items():
+            attr = test_dict.get(test) or {}
+            num_instr = attr.get('num_instr')
+            rows.append((self.run, stage, test,
+                         attr.get('generator', generator), seconds,
+                         num_instr if isinstance(num_instr, int) else None))
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def durations(self, stage, tests):
+        '''
+            Function to read the recent durations of a stage in earlier runs.
+
+            :param stage: The stage, like dut
+
+            :param tests: Names of the tests
+
+            :type stage: str
+
+            :type tests: dict
+
+            :return: Seconds and number of instructions of each test in the
+                recent runs, newest first
+
+            :rtype: dict
+        '''
+        if self.reader is None:
+            return {}
+        # Runs recorded in the same database from this one on are excluded
+        before = self.run if self.reader is self.connection else sys.maxsize
+        cache = self._samples.setdefault(stage, {})
+        samples = {}
+        for test in tests:
+            if test not in cache:
+                cache[test] = self.reader.execute(
+                    'SELECT seconds, num_instr FROM durations '
+                    'WHERE stage = ? AND test = ? AND run < ? '
+                    'ORDER BY run DESC LIMIT ?',
+                    (stage, test, before, recent_runs)).fetchall()
+            if cache[test]:
+                samples[test] = cache[test]
+        return samples
+
+    def estimates(self, test_dict, stages):
+        '''
+            Function to estimate the seconds each test takes, as the sum over
+            the stages of the median of its recent durations. Tests without
+            a history get the median of the tests of their generator, or of
+            all the tests.
+
+            :param test_dict: The test list
+
+            :param stages: The stages, like dut and ref
+
+            :type test_dict: dict
+
+            :type stages: list
+
+            :return: Estimated seconds of each test, empty without a history
+
+            :rtype: dict
+        '''
+        estimates = {}
+        for stage in stages:
+            samples = self.durations(stage, test_dict)
+            if not samples:
+                continue
+            medians = {
+                test: median([seconds for seconds, _ in test_samples])
+                for test, test_samples in samples.items()
+            }
+            by_generator = {}
+            for test, seconds in medians.items():
+                by_generator.setdefault(test_dict[test].get('generator'),
+                                        []).append(seconds)
+            by_generator = {
+                generator: median(values)
+                for generator, values in by_generator.items()
+            }
+            default = median(list(medians.values()))
+            for test, attr in test_dict.items():
+                seconds = medians.get(test,
+                                      by_generator.get(attr.get('generator'),
+                                                       default))
+                estimates[test] = estimates.get(test, 0) + seconds
+        return estimates
+
+    def timeouts(self, test_dict, stages, factor):
+        '''
+            Function to find the timeout of each test with enough history, as
+            a multiple of the 99th percentile of its recent durations in the
+            slowest of the stages.
+
+            :param test_dict: The test list
+
+            :param stages: The stages, like dut and ref
+
+            :param factor: Multiple of the 99th percentile
+
+            :type test_dict: dict
+
+            :type stages: list
+
+            :type factor: float
+
+            :return: Timeout in seconds of each test
+
+            :rtype: dict
+        '''
+        timeouts = {}
+        for stage in stages:
+            samples = self.durations(stage, test_dict)
+            for test, test_samples in samples.items():
+                if len(test_samples) < min_runs:
+                    continue
+                timeout = max(
+                    math.ceil(
+                        factor *
+                        percentile([seconds for seconds, _ in test_samples],
+                                   0.99)), min_timeout)
+                timeouts[test] = max(timeouts.get(test, 0), timeout)
+        return timeouts
+
+    def regressions(self, durations, test_dict, stage='dut'):
+        '''
+            Function to find the tests which the DuT simulated more than
+            :py:data:`slowdown` times slower than the median of their recent
+            runs, in instructions per second.
+
+            :param durations: Seconds taken by each test in this run
+
+            :param test_dict: The test list, with the number of instructions
+
+            :param stage: The stage of the durations
+
+            :type durations: dict
+
+            :type test_dict: dict
+
+            :type stage: str
+
+            :return: Test, instructions per second in this run and the median
+                of the recent runs, slowest first
+
+            :rtype: list
+        '''
+        samples = self.durations(stage, durations)
+        regressions = []
+        for test, seconds in durations.items():
+            num_instr = test_dict[test].get('num_instr')
+            if not isinstance(num_instr, int) or num_instr <= 0 or \
+                    seconds <= 0:
+                continue
+            speeds = [
+                instr / duration for duration, instr in samples.get(test, [])
+                if instr and duration > 0
+            ]
+            if len(speeds) < min_runs:
+                continue
+            speed = num_instr / seconds
+            usual = median(speeds)
+            if speed * slowdown < usual:
+                regressions.append((test, speed, usual))
+        return sorted(regressions, key=lambda row: row[1] / row[2])
+
+    def close(self):
+        '''
+            Function to close the database.
+        '''
+        if self.reader is not None and self.reader is not self.connection:
+            self.reader.close()
+        self.connection.close()
+
+
+def merge_shards(config):
+    '''
+        Function to merge the databases recorded by the shards of a run into
+        the history database of the config. The databases of the shards are
+        removed once merged.
+
+        :param config: The river_core config
+
+        :type config: configparser.ConfigParser
+
+        :return: Number of databases merged
+
+        :rtype: int
+    '''
+    path = history_path(config)
+    found = sharding.find_shards(path)
+    if found is None:
+        return 0
+    history = History(path)
+    for index, shard_path in sorted(found[1].items()):
+        shard = sqlite3.connect(shard_path)
+        try:
+            for run, date, version, command in shard.execute(
+                    'SELECT run, date, version, command FROM runs ORDER BY run'
+            ).fetchall():
+                with history.connection:
+                    merged_run = history.connection.execute(
+                        'INSERT INTO runs (date, version, command) VALUES (?, ?, ?)',
+                        (date, version, command)).lastrowid
+                    history.connection.executemany(
+                        'INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?)',
+                        ((merged_run,) + row for row in shard.execute(
+                            'SELECT stage, test, generator, seconds, num_instr '
+                            'FROM durations WHERE run = ?', (run,))))
+        finally:
+            shard.close()
+        os.remove(shard_path)
+        logger.info('Merged the history of ' + shard_path)
+    history.close()
+    return len(found[1])
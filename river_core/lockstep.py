@@ -0,0 +1,228 @@
+# See LICENSE for details
+"""Lockstep comparison of the DuT and reference dumps through FIFOs"""
+import os
+import time
+import queue
+import shlex
+import itertools
+import threading
+import subprocess
+from collections import deque
+from river_core.log import logger
+import river_core.utils as utils
+
+#: Result of a lockstep comparison in the work_dir, read by the compare of
+#: river_core compile in place of the dumps
+result_file = 'lockstep.yaml'
+
+#: FIFOs in the work_dir which the simulators write their dumps to
+fifo_names = {'dut': 'dut.fifo', 'ref': 'ref.fifo'}
+
+#: Number of records passed from a reader thread to the comparison at a time
+batch_size = 1024
+
+# Batches buffered per simulator. A simulator running ahead of the other
+# blocks on the FIFO once these are full.
+_queue_size = 64
+
+
+class _Dump():
+    '''
+        Records of a simulator read from its FIFO by a thread.
+    '''
+
+    def __init__(self, name, fifo):
+        self.name = name
+        self.fifo = fifo
+        self.process = None
+        self.batches = queue.Queue(maxsize=_queue_size)
+        self.opened = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        # Blocks until the simulator opens the FIFO for writing
+        with open(self.fifo, 'r', errors='replace') as dump:
+            self.opened.set()
+            batch = []
+            for record in dump:
+                batch.append(record)
+                if len(batch) == batch_size:
+                    self.batches.put(batch)
+                    batch = []
+            self.batches.put(batch)
+        self.batches.put(None)
+
+    def _unblock(self):
+        # A simulator which exits without opening its FIFO leaves the reader
+        # waiting in open, which returns once any writer opens it
+        try:
+            os.close(os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+    def records(self, deadline):
+        '''
+            Generator of the records of the simulator.
+
+            :param deadline: time.monotonic() after which the comparison stops
+
+            :type deadline: float
+        '''
+        while True:
+            try:
+                batch = self.batches.get(timeout=1)
+            except queue.Empty:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(self.name)
+                if self.process.poll() is not None and not self.opened.is_set():
+                    self._unblock()
+                continue
+            if batch is None:
+                return
+            yield from batch
+
+    def close(self):
+        '''
+            Function to stop the reader thread once the simulator has exited.
+        '''
+        if not self.opened.is_set():
+            self._unblock()
+        while self.thread.is_alive():
+            try:
+                self.batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def compare(work_dir,
+            dut_command,
+            ref_command,
+            timeout=1800,
+            window=8,
+            skip=None):
+    '''
+        Function to compare the dumps of the DuT and the reference model
+        while they run, without writing the dumps to disk. The commands are
+        run in the work_dir by the shell with ``{dump}`` replaced by the FIFO
+        they must write their dump to, and the records are compared with
+        :py:func:`river_core.utils.compare_records` as they are read. Both
+        simulators are killed at the first mismatch, or when the timeout
+        expires.
+
+        The simulators write their raw output, which the plugins would trim
+        from a dump on disk, so the records given by skip are dropped from
+        both streams, see :py:func:`river_core.utils.test_skip`.
+
+        The result is saved as lockstep.yaml in the work_dir, which the
+        compare of river_core compile reads when the test has no dumps.
+
+        :param work_dir: Work directory of the test
+
+        :param dut_command: Shell command running the DuT
+
+        :param ref_command: Shell command running the reference model
+
+        :param timeout: Seconds after which both simulators are killed
+
+        :param window: Number of records before a mismatch included in the log
+
+        :param skip: Records skipped, with the keys dut_head, dut_tail,
+            ref_head and ref_tail
+
+        :type work_dir: str
+
+        :type dut_command: str
+
+        :type ref_command: str
+
+        :type timeout: int
+
+        :type window: int
+
+        :type skip: dict
+
+        :return: Result ('Passed' or 'Failed'), log of the mismatch and number
+            of records compared
+
+        :rtype: tuple
+    '''
+    work_dir = os.path.abspath(work_dir)
+    skip = skip or {}
+    commands = {'dut': dut_command, 'ref': ref_command}
+    dumps = {}
+    for name, fifo_name in fifo_names.items():
+        fifo = os.path.join(work_dir, fifo_name)
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+        dumps[name] = _Dump(name, fifo)
+    for name, dump in dumps.items():
+        command = commands[name].replace('{dump}', shlex.quote(dump.fifo))
+        logger.debug('$ ' + command)
+        with open(os.path.join(work_dir, 'lockstep_{0}.log'.format(name)),
+                  'w') as log_file:
+            dump.process = subprocess.Popen(command,
+                                            shell=True,
+                                            cwd=work_dir,
+                                            stdout=log_file,
+                                            stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+
+    deadline = time.monotonic() + timeout
+    history = deque(maxlen=window)
+    count = 0
+    result = 'Passed'
+    log = ''
+    try:
+        dut_records = utils.skip_records(dumps['dut'].records(deadline),
+                                         skip.get('dut_head', 0),
+                                         skip.get('dut_tail', 0))
+        ref_records = utils.skip_records(dumps['ref'].records(deadline),
+                                         skip.get('ref_head', 0),
+                                         skip.get('ref_tail', 0))
+        for dut_record, ref_record in itertools.zip_longest(
+                dut_records, ref_records):
+            if dut_record is None or ref_record is None:
+                ended = 'DuT' if dut_record is None else 'REF'
+                log = '{0} dump ended after {1} records'.format(ended, count)
+                result = 'Failed'
+                break
+            mismatch = utils.compare_records(dut_record, ref_record)
+            if mismatch is not None:
+                kind, dut_pc, ref_pc = mismatch
+                log = 'Mismatch at record {0}'.format(count + 1)
+                if kind == 'BM':
+                    log += '\nBM: DuT at PC: {0} and REF at PC: {1}'.format(
+                        dut_pc, ref_pc)
+                elif kind == 'SM':
+                    log += '\nSM: at PC: {0}'.format(dut_pc)
+                log += ''.join('\n  ' + record.rstrip() for record in history)
+                log += '\n< ' + dut_record.rstrip()
+                log += '\n> ' + ref_record.rstrip()
+                result = 'Failed'
+                break
+            history.append(dut_record)
+            count = count + 1
+    except TimeoutError:
+        log = 'Simulators did not finish within {0} seconds, {1} records compared'.format(
+            timeout, count)
+        result = 'Failed'
+    finally:
+        for dump in dumps.values():
+            if result != 'Passed':
+                utils.kill_process_group(dump.process)
+            try:
+                dump.process.wait(max(deadline - time.monotonic(), 1))
+            except subprocess.TimeoutExpired:
+                utils.kill_process_group(dump.process)
+                dump.process.wait()
+            dump.close()
+            os.remove(dump.fifo)
+
+    utils.save_yaml({
+        'result': result,
+        'log': log,
+        'num_instr': count
+    }, os.path.join(work_dir, result_file))
+    return result, log, count
@@ -1,6 +1,9 @@
 # See LICENSE for details
 
+import atexit
 import logging
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
 import colorlog
 
 # a theme is just a dict of strings to represent each level
@@ -18,6 +21,13 @@ class Log:
     this class holds all the logic; see the end of the script to
     see how it's instantiated in order to have the line
     "from zenlog import log" work
+
+    Before forking the workers of a Pool, call :meth:`start_queue`. From
+    then on the records are not written by the process logging them. They
+    are put on a queue and written by a listener thread of the process which
+    started it, so the workers send their records to the parent instead of
+    sharing its file handle and stream. Until then the records are written
+    directly, and no queue or thread is created.
     """
 
     aliases = {
@@ -44,14 +54,38 @@ class Log:
         self.logger = logging.getLogger('pythonConfig')
         self.logger.setLevel(self._lvl)
         self.logger.addHandler(self.stream)
+        self.queue = None
+        self.listener = None
         self.theme = THEME
         self.extra = {"styledname": self.theme[self._lvl]}
 
+    def start_queue(self):
+        '''
+        Send the records through a queue to a listener thread of this process
+        from now on. Called before creating a Pool, whose forked workers
+        inherit the queue. Calling it again does nothing.
+        '''
+        if self.listener is not None:
+            return
+        self.queue = multiprocessing.Queue(-1)
+        self.listener = QueueListener(self.queue,
+                                      self.stream,
+                                      *logging.root.handlers,
+                                      respect_handler_level=True)
+        self.logger.removeHandler(self.stream)
+        self.logger.addHandler(QueueHandler(self.queue))
+        # The listener writes to the handlers of the root logger as well
+        self.logger.propagate = False
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
     # the magic happens here: we use the "extra" argument documented in
     # https://docs.python.org/2/library/logging.html#logging.Logger.debug
     # to inject new items into the logging.LogRecord objects
     # we also create our convenience methods here
     def critical(self, message, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.CRITICAL):
+            return
         for line in str(message).splitlines():
             self.logger.critical(
                 line,
@@ -62,6 +96,8 @@ class Log:
     crit = c = fatal = critical
 
     def error(self, message, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
         for line in str(message).splitlines():
             self.logger.error(line,
                               extra={"styledname": self.theme[logging.ERROR]},
@@ -71,6 +107,8 @@ class Log:
     err = e = error
 
     def warn(self, message, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.WARNING):
+            return
         for line in str(message).splitlines():
             self.logger.warning(
                 line,
@@ -81,6 +119,8 @@ class Log:
     warning = w = warn
 
     def info(self, message, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         for line in str(message).splitlines():
             self.logger.info(line,
                              extra={"styledname": self.theme[logging.INFO]},
@@ -90,6 +130,8 @@ class Log:
     inf = nfo = i = info
 
     def debug(self, message, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         for line in str(message).splitlines():
             self.logger.debug(line,
                               extra={"styledname": self.theme[logging.DEBUG]},
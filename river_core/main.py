@@ -3,10 +3,14 @@
 import click
 import os
 from river_core.log import *
-from river_core.rivercore import rivercore_clean, rivercore_compile, rivercore_generate, rivercore_merge, rivercore_setup
+from river_core.rivercore import rivercore_clean, rivercore_collect, rivercore_compile, rivercore_generate, rivercore_merge, rivercore_setup
 from river_core.__init__ import __version__
 import river_core.constants as constants
 import river_core.utils as utils
+import river_core.profiling as profiling
+import river_core.status as status
+import river_core.shard as sharding
+from river_core.lockstep import compare as lockstep_compare
 import pytest
 
 def check_config():
@@ -25,6 +29,14 @@ def check_config():
         raise SystemExit(1)
 
 
+profile_option = click.option(
+    '--profile',
+    is_flag=True,
+    help=
+    'Profile the framework and save the merged stats in the reports directory of the work_dir'
+)
+
+
 @click.group()
 @click.version_option(version=__version__)
 def cli():
@@ -43,15 +55,18 @@ def cli():
     help=
     'Read option defaults from the INI file\nAuto detects river_core.ini in current directory or in the ~ directory'
 )
+@profile_option
 @cli.command()
-def clean(config, verbosity):
+def clean(config, verbosity, profile):
     '''
         subcommand to clean generated programs.
     '''
     logger.info(constants.header_temp.format(__version__))
     if not config:
         config = check_config()
-    rivercore_clean(config, verbosity)
+    # work_dir is removed while cleaning, so the profile is saved in cwd
+    with profiling.session(profile, 'clean', os.getcwd()):
+        rivercore_clean(config, verbosity)
 
 
 # -------------------------
@@ -87,14 +102,16 @@ def clean(config, verbosity):
               '--verbosity',
               default='info',
               help='Set the verbosity level for the framework')
+@profile_option
 @cli.command()
-def setup(config, dut, gen, ref, verbosity):
+def setup(config, dut, gen, ref, verbosity, profile):
     '''
         subcommand to generate template setup files.
     '''
     logger.info(constants.header_temp.format(__version__))
 
-    rivercore_setup(config, dut, gen, ref, verbosity)
+    with profiling.session(profile, 'setup', os.getcwd()):
+        rivercore_setup(config, dut, gen, ref, verbosity)
 
 
 # -------------------------
@@ -151,9 +168,34 @@ def setup(config, dut, gen, ref, verbosity):
     default = -1,
     help = 'Timeout period for tests'
 )
+@click.option(
+    '--report_interval',
+    default=0,
+    help=
+    'Update the HTML report every given number of seconds while the logs are compared. 0 generates only the final report'
+)
+@click.option(
+    '--shard',
+    help=
+    'Run only the K-th of N shards of the test list, given as K/N, writing shard-local result files which river_core collect combines'
+)
+@click.option(
+    '--shard_weights',
+    type=click.Path(dir_okay=False, exists=True),
+    help=
+    'result_list.yaml of an earlier run, whose instruction counts balance the shards instead of the hash of the test names'
+)
+@click.option(
+    '--timeout_factor',
+    default=3.0,
+    help=
+    'Set the timeout of each test in the test list to this multiple of the 99th percentile of its durations in earlier runs, from the history database. 0 uses only --timeout'
+)
+@profile_option
 @cli.command()
 def compile(config, test_list, coverage, verbosity, dut_stage, ref_stage,
-            compare, nproc, timeout):
+            compare, nproc, timeout, report_interval, shard, shard_weights,
+            timeout_factor, profile):
     '''
         subcommand to compile generated programs.
     '''
@@ -182,8 +224,11 @@ def compile(config, test_list, coverage, verbosity, dut_stage, ref_stage,
                 logger.warning(
                     'Compare is enabled\nThis will be generating incomplete reports'
                 )
-    rivercore_compile(config, test_list, coverage, verbosity, dut_stage,
-                      ref_stage, compare, nproc, timeout)
+    with profiling.session(profile, 'compile', profiling.work_dir(config)):
+        rivercore_compile(config, test_list, coverage, verbosity, dut_stage,
+                          ref_stage, compare, nproc, timeout, report_interval,
+                          sharding.parse_shard(shard), shard_weights,
+                          timeout_factor)
     
 @click.option('-t',
               '--test_list',
@@ -194,17 +239,164 @@ def compile(config, test_list, coverage, verbosity, dut_stage, ref_stage,
               '--hart_id',
               help='Hartid to be used',
               required=True)
+@click.option(
+    '--watch',
+    is_flag=True,
+    help=
+    'Keep polling the tests and show the progress of the regression until all the tests are compared'
+)
+@click.option('--interval',
+              default=5.0,
+              help='Seconds between the polls of --watch')
+@click.option('--format',
+              'output_format',
+              type=click.Choice(['json', 'csv']),
+              default='json',
+              help='Format of the status of the tests')
+@click.option(
+    '-o',
+    '--output',
+    type=click.Path(dir_okay=False),
+    help=
+    'File to save the status of the tests. Defaults to test_enquire-status.<format>'
+)
+@click.option('--html',
+              is_flag=True,
+              help='Also save the status as test_enquire-status.html')
+@click.option('--nproc',
+              default=16,
+              help='Number of threads checking the tests')
+@click.option(
+    '--pytest-html',
+    is_flag=True,
+    help=
+    'Check the tests in a pytest session and save the pytest-html report test_enquire-report.html'
+)
+@profile_option
 @cli.command()
-def enquire(test_list,hart_id):
+def enquire(test_list, hart_id, watch, interval, output_format, output, html,
+            nproc, pytest_html, profile):
     '''
     subcommand to enquire status of tests.
     '''
+    if watch:
+        with profiling.session(profile, 'enquire', os.getcwd()):
+            status.watch(test_list, hart_id, interval, nproc)
+        return
+    if not pytest_html:
+        if not output:
+            output = 'test_enquire-status.' + output_format
+        with profiling.session(profile, 'enquire', os.getcwd()):
+            status.enquire(test_list, hart_id, output, output_format,
+                           'test_enquire-status.html' if html else None,
+                           nproc)
+        return
     enquire.test_list = test_list
     enquire.hart_id = hart_id
-    pytest.main(['--log-cli-level=0', \
-                 '--html=test_enquire-report.html', \
-                '--self-contained-html', \
-                __file__.rstrip('main.py')+'enquire.py'])
+    with profiling.session(profile, 'enquire', os.getcwd()):
+        pytest.main(['--log-cli-level=0', \
+                     '--html=test_enquire-report.html', \
+                    '--self-contained-html', \
+                    __file__.rstrip('main.py')+'enquire.py'])
+
+
+@click.version_option(version=__version__)
+@click.option('-v',
+              '--verbosity',
+              default='info',
+              help='Set the verbosity level for the framework')
+@click.option('-w',
+              '--work_dir',
+              type=click.Path(file_okay=False, exists=True),
+              default='.',
+              help='Work directory of the test')
+@click.option(
+    '--dut',
+    help=
+    'Shell command running the DuT, with {dump} in place of the file it writes the dump to',
+    required=True)
+@click.option(
+    '--ref',
+    help=
+    'Shell command running the reference model, with {dump} in place of the file it writes the dump to',
+    required=True)
+@click.option('--timeout',
+              default=1800,
+              help='Seconds after which both simulators are killed')
+@click.option('--window',
+              default=8,
+              help='Number of records before a mismatch shown in the log')
+@click.option('-t',
+              '--test_list',
+              type=click.Path(dir_okay=False, exists=True),
+              help='Test list whose entry of the test gives the records skipped by the compare')
+@click.option('--test',
+              help='Name of the test in the test list, by default the one whose work_dir is given')
+@profile_option
+@cli.command()
+def lockstep(verbosity, work_dir, dut, ref, timeout, window, test_list, test,
+             profile):
+    '''
+    subcommand to compare the dumps of a test while the DuT and reference model run.
+    '''
+    logger.level(verbosity)
+    skip = None
+    if test_list:
+        test_dict = utils.load_yaml(test_list)
+        if test is None:
+            test = next((name for name, attr in test_dict.items()
+                         if os.path.abspath(attr['work_dir']) ==
+                         os.path.abspath(work_dir)), None)
+        if test not in test_dict:
+            logger.error('Test {0} not found in {1}'.format(
+                test or work_dir, test_list))
+            raise SystemExit(1)
+        skip = utils.test_skip(test_dict[test], raw=True)
+    with profiling.session(profile, 'lockstep', work_dir):
+        result, log, count = lockstep_compare(work_dir, dut, ref, timeout,
+                                              window, skip)
+    if result != 'Passed':
+        logger.error(log)
+        raise SystemExit(1)
+    logger.info('{0} records matched'.format(count))
+
+
+@click.version_option(version=__version__)
+@click.option('-v',
+              '--verbosity',
+              default='info',
+              help='Set the verbosity level for the framework')
+@click.option('-w',
+              '--work_dir',
+              type=click.Path(file_okay=False, exists=True),
+              default='.',
+              help='Work directory of the test, with its dut.dump and ref.dump')
+@click.option('--record',
+              type=int,
+              help='Number of the record to show, from 1')
+@click.option('--pc', help='PC to show, when no record is given')
+@click.option('--occurrence',
+              default=1,
+              help='Occurrence of the PC to show, from 1')
+@click.option('--window',
+              default=8,
+              help='Number of records shown before and after')
+@cli.command()
+def triage(verbosity, work_dir, record, pc, occurrence, window):
+    '''
+    subcommand to show the records of the dumps of a test around a record or PC.
+    '''
+    logger.level(verbosity)
+    if record is None and pc is None:
+        logger.error('Either --record or --pc is required')
+        raise SystemExit(1)
+    for name in ('dut.dump', 'ref.dump'):
+        dump = utils.find_dump(os.path.join(work_dir, name))
+        if dump is None:
+            logger.error('{0} not found in {1}'.format(name, work_dir))
+            raise SystemExit(1)
+        click.echo(
+            utils.dump_window(dump, record, pc, occurrence, window))
 
 
 @click.version_option(version=__version__)
@@ -224,15 +416,46 @@ def enquire(test_list,hart_id):
     help=
     'Override the test generators given by the config file'
 )
+@click.option(
+    '--shard',
+    help=
+    'Run only the K-th of N shards of the test generators, given as K/N with N at most the number of generators, writing a shard-local test list which river_core collect combines'
+)
+@profile_option
 @cli.command()
-def generate(config, verbosity, filter_testgen):
+def generate(config, verbosity, filter_testgen, shard, profile):
     """
     subcommand to generate programs.
     """
     logger.info(constants.header_temp.format(__version__))
     if not config:
         config = check_config()
-    rivercore_generate(config, verbosity, filter_testgen)
+    with profiling.session(profile, 'generate', profiling.work_dir(config)):
+        rivercore_generate(config, verbosity, filter_testgen,
+                           sharding.parse_shard(shard))
+
+
+@click.version_option(version=__version__)
+@click.option('-v',
+              '--verbosity',
+              default='info',
+              help='Set the verbosity level for the framework')
+@click.option(
+    '-c',
+    '--config',
+    type=click.Path(dir_okay=False, exists=True),
+    help=
+    'Read option defaults from the INI file\nAuto detects river_core.ini in current directory or in the ~ directory'
+)
+@cli.command()
+def collect(config, verbosity):
+    """
+    subcommand to combine the results of the shards of generate and compile.
+    """
+    logger.info(constants.header_temp.format(__version__))
+    if not config:
+        config = check_config()
+    rivercore_collect(config, verbosity)
 
 
 @click.version_option(version=__version__)
@@ -247,17 +470,63 @@ def generate(config, verbosity, filter_testgen):
               '--verbosity',
               default='info',
               help='set the verbosity level for the framework')
+@click.option(
+    '--nproc',
+    default=8,
+    help=
+    'Number of threads copying the tests of the databases and of coverage merges run in parallel'
+)
+@click.option(
+    '--link/--no-link',
+    default=True,
+    help=
+    'Reflink the files of the databases instead of copying them when the filesystem supports it. Reflinked files share their data until either is written.'
+)
+@click.option(
+    '--hardlink',
+    is_flag=True,
+    help=
+    'Hardlink the files of the databases when they cannot be reflinked and are on the same filesystem. Hardlinked files are shared with the source database, so editing one changes the other.'
+)
+@click.option(
+    '--link-only',
+    is_flag=True,
+    help=
+    'Merge only the test lists and coverage databases. The merged tests point to their files in the source databases, which are kept.'
+)
+@click.option(
+    '--fan_in',
+    default=0,
+    help=
+    'Merge the coverage databases in parallel batches of this size, then merge the batches. 0 merges all of them at once'
+)
+@click.option(
+    '--merge_cache',
+    type=click.Path(file_okay=False),
+    help=
+    'Directory to keep the merged batches, which are reused by later merges. Defaults to .river_core_merge_cache next to the output'
+)
+@click.option(
+    '--incremental',
+    is_flag=True,
+    help=
+    'Add the databases to the output of a previous merge instead of overwriting it. Only new or changed tests and coverage databases are merged.'
+)
 @click.argument('db_files', nargs=-1, type=click.Path(exists=True))
 @click.argument('output', nargs=1, type=click.Path())
+@profile_option
 @cli.command()
-def merge(verbosity, db_files, output, config):
+def merge(verbosity, db_files, output, config, nproc, link, hardlink,
+          link_only, fan_in, merge_cache, incremental, profile):
     """
     subcommand to merge coverage databases.
     """
     logger.info(constants.header_temp.format(__version__))
     if not config:
         config = check_config()
-    rivercore_merge(verbosity, db_files, output, config)
+    with profiling.session(profile, 'merge', profiling.work_dir(config)):
+        rivercore_merge(verbosity, db_files, output, config, nproc, link,
+                        link_only, fan_in, merge_cache, incremental, hardlink)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,263 @@
+# See LICENSE for details
+"""Tree reduction of coverage databases around the merge_db hook"""
+import os
+import glob
+import json
+import shutil
+import hashlib
+import multiprocessing
+from river_core.log import logger
+import river_core.utils as utils
+
+# Plugin manager and config of the merge in progress. Set before forking the
+# workers, which inherit them instead of receiving them pickled.
+_dutpm = None
+_config = None
+
+#: Manifest of an output directory, listing what was merged into it
+manifest_file = '.merge_manifest.yaml'
+
+#: Extension of the coverage databases written by each simulator
+db_extensions = {'cadence': '.ucd', 'questa': '.ucdb', 'verilator': '.dat'}
+
+
+def db_extension(target):
+    '''
+        Function to find the extension of the coverage databases of a target.
+
+        :param target: Name of the DuT plugin
+
+        :type target: str
+
+        :return: Extension of the databases, None for unknown simulators
+
+        :rtype: str
+    '''
+    for simulator, extension in db_extensions.items():
+        if simulator in target:
+            return extension
+    return None
+
+
+def db_stat(db_file):
+    '''
+        Function to identify a version of a coverage database.
+
+        :param db_file: Path of the database
+
+        :type db_file: str
+
+        :return: Absolute path, size and modification time of the database
+
+        :rtype: list
+    '''
+    stat = os.stat(db_file)
+    return [os.path.abspath(db_file), stat.st_size, stat.st_mtime_ns]
+
+
+def test_signature(attr):
+    '''
+        Function to identify a version of a test in a source database, from
+        its entry in the test list and the files in its work_dir.
+
+        :param attr: Entry of the test in the test list
+
+        :type attr: dict
+
+        :return: Hex digest identifying the test
+
+        :rtype: str
+    '''
+    digest = hashlib.sha1(
+        json.dumps(attr, sort_keys=True, default=str).encode())
+    try:
+        for entry in sorted(os.scandir(attr['work_dir']),
+                            key=lambda entry: entry.name):
+            stat = entry.stat(follow_symlinks=False)
+            digest.update('{0}:{1}:{2}'.format(entry.name, stat.st_size,
+                                               stat.st_mtime_ns).encode())
+    except OSError:
+        pass
+    return digest.hexdigest()[:16]
+
+
+def load_manifest(output):
+    '''
+        Function to read the manifest of a merged output directory.
+
+        :param output: Output directory of a previous merge
+
+        :type output: str
+
+        :return: The manifest, None when the directory has none
+
+        :rtype: dict
+    '''
+    path = os.path.join(output, manifest_file)
+    if not os.path.isfile(path):
+        return None
+    manifest = utils.load_yaml(path)
+    manifest.setdefault('databases', {})
+    manifest.setdefault('coverage', [])
+    manifest.setdefault('coverage_html', [])
+    return manifest
+
+
+def save_manifest(output, manifest):
+    '''
+        Function to write the manifest of a merged output directory.
+
+        :param output: Output directory of the merge
+
+        :param manifest: Source databases, tests and coverage databases merged into the output
+
+        :type output: str
+
+        :type manifest: dict
+    '''
+    utils.save_yaml(manifest, os.path.join(output, manifest_file))
+
+
+def subset_key(db_files):
+    '''
+        Function to find the cache key of a set of databases. The key changes
+        when any of the databases is modified.
+
+        :param db_files: Databases merged together
+
+        :type db_files: list
+
+        :return: Hex digest identifying the databases
+
+        :rtype: str
+    '''
+    stats = [db_stat(db_file) for db_file in db_files]
+    return hashlib.sha1(json.dumps(stats).encode()).hexdigest()[:16]
+
+
+def find_db(output_db, extension):
+    '''
+        Function to find the database written by the merge_db hook.
+
+        :param output_db: The output_db passed to the hook
+
+        :param extension: Extension of the databases
+
+        :type output_db: str
+
+        :type extension: str
+
+        :return: Path of the merged database, None when it was not written
+
+        :rtype: str
+    '''
+    found = sorted(glob.glob(output_db + '/final_coverage/*' + extension))
+    return found[0] if found else None
+
+
+def _merge_subset(args):
+    db_files, output_db, extension = args
+    # A previous attempt may have been interrupted
+    if os.path.exists(output_db):
+        shutil.rmtree(output_db)
+    os.makedirs(output_db + '/final_coverage')
+    _dutpm.hook.merge_db(db_files=db_files, config=_config, output_db=output_db)
+    merged = find_db(output_db, extension)
+    if merged is None:
+        raise RuntimeError('merge_db did not write a {0} file in {1}'.format(
+            extension, output_db + '/final_coverage'))
+    open(output_db + '/.done', 'w').close()
+    return merged
+
+
+def tree_merge(dutpm, config, db_files, output, extension, fan_in,
+               process_count, cache_dir):
+    '''
+        Function to merge coverage databases as a tree. The databases are
+        merged in batches of fan_in in parallel, then the intermediate
+        databases are merged the same way until a single batch is left, which
+        is merged into the output by the plugin like a regular merge.
+
+        The intermediate databases are kept in the cache_dir, keyed by the
+        databases they were merged from. Batches are formed in the order of
+        the modification time of the databases, so when new databases are
+        added to a repeated merge, the batches of the older ones are found in
+        the cache and only the new ones are merged again.
+
+        :param dutpm: Plugin manager with the DuT plugin registered
+
+        :param config: Config of river_core
+
+        :param db_files: Databases to merge
+
+        :param output: Output directory of the merge
+
+        :param extension: Extension of the databases
+
+        :param fan_in: Number of databases merged by each call of the hook
+
+        :param process_count: Number of hook calls run in parallel
+
+        :param cache_dir: Directory of the intermediate databases
+
+        :type dutpm: pluggy.PluginManager
+
+        :type config: configparser.ConfigParser
+
+        :type db_files: list
+
+        :type output: str
+
+        :type extension: str
+
+        :type fan_in: int
+
+        :type process_count: int
+
+        :type cache_dir: str
+
+        :return: Return value of the final merge_db hook call
+
+        :rtype: list
+    '''
+    global _dutpm, _config
+    _dutpm = dutpm
+    _config = config
+    level = sorted(db_files, key=lambda db: (os.stat(db).st_mtime_ns, db))
+    depth = 0
+    # Plugins may chdir, so each hook call runs in its own forked process
+    context = multiprocessing.get_context('fork')
+    while len(level) > fan_in:
+        depth = depth + 1
+        batches = [
+            level[start:start + fan_in]
+            for start in range(0, len(level), fan_in)
+        ]
+        next_level = [None] * len(batches)
+        pending = []
+        cached = 0
+        for index, batch in enumerate(batches):
+            if len(batch) == 1:
+                next_level[index] = batch[0]
+                continue
+            output_db = os.path.join(cache_dir, subset_key(batch))
+            merged = find_db(output_db, extension)
+            if merged and os.path.exists(output_db + '/.done'):
+                next_level[index] = merged
+                cached = cached + 1
+            else:
+                pending.append((index, (batch, output_db, extension)))
+        logger.info(
+            'Merge level {0}: {1} batches, {2} found in the cache'.format(
+                depth, len(batches), cached))
+        if pending:
+            logger.start_queue()
+            with context.Pool(processes=process_count,
+                              maxtasksperchild=1) as pool:
+                results = pool.map(_merge_subset,
+                                   [args for _, args in pending])
+            for (index, _), merged in zip(pending, results):
+                next_level[index] = merged
+        level = next_level
+    logger.info('Merging the final {0} databases'.format(len(level)))
+    return dutpm.hook.merge_db(db_files=level, config=config, output_db=output)
@@ -0,0 +1,147 @@
+# See LICENSE for details
+"""Profiling hooks for the framework's own python code paths"""
+import os
+import io
+import glob
+import pstats
+import cProfile
+import configparser
+from contextlib import contextmanager
+from multiprocessing import util as mp_util
+from river_core.log import logger
+
+# Directory where the Pool workers dump their stats. Set only while a
+# profiling session is active and inherited by the forked workers.
+profile_dir = None
+
+
+def work_dir(config_file):
+    '''
+        Function to find the work_dir where the profile reports are saved.
+
+        :param config_file: Config.ini file for river_core
+
+        :type config_file: str
+
+        :return: The work_dir from the config or the current directory
+
+        :rtype: str
+    '''
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser(config_file))
+    try:
+        return config['river_core']['work_dir']
+    except KeyError:
+        return os.getcwd()
+
+
+def init_worker():
+    '''
+        Initializer for the Pool workers. When a profiling session is active,
+        the worker is profiled for its whole life and the stats are dumped
+        when the worker exits. The pool must be closed and joined (not
+        terminated) for the stats to be written.
+    '''
+    if profile_dir is None:
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def dump():
+        profiler.disable()
+        profiler.dump_stats(
+            os.path.join(profile_dir, 'worker_{0}.prof'.format(os.getpid())))
+
+    mp_util.Finalize(None, dump, exitpriority=16)
+
+
+@contextmanager
+def session(enabled, name, output_dir):
+    '''
+        Context manager to profile a subcommand along with the Pool workers
+        it launches. On exit the stats of all processes are merged into
+        ``<output_dir>/reports/<name>.prof`` (pstats format, usable with
+        snakeviz, flameprof, gprof2dot, etc.) and a text summary is saved in
+        ``<output_dir>/reports/<name>_profile.txt``.
+
+        :param enabled: Profile only if set
+
+        :param name: Name of the subcommand being profiled
+
+        :param output_dir: Directory where the reports are saved
+
+        :type enabled: bool
+
+        :type name: str
+
+        :type output_dir: str
+    '''
+    global profile_dir
+    if not enabled:
+        yield
+        return
+    report_dir = os.path.join(os.path.abspath(output_dir), 'reports')
+    worker_dir = os.path.join(report_dir, '.profile_{0}'.format(name))
+    os.makedirs(worker_dir, exist_ok=True)
+    for stale in glob.glob(worker_dir + '/worker_*.prof'):
+        os.remove(stale)
+    profile_dir = worker_dir
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_dir = None
+        save_report(profiler, name, report_dir, worker_dir)
+
+
+def save_report(profiler, name, report_dir, worker_dir):
+    '''
+        Function to merge the stats of the main process and the workers and
+        save the reports.
+
+        :param profiler: Profiler of the main process
+
+        :param name: Name of the subcommand profiled
+
+        :param report_dir: Directory where the reports are saved
+
+        :param worker_dir: Directory containing the worker stats
+
+        :type profiler: cProfile.Profile
+
+        :type name: str
+
+        :type report_dir: str
+
+        :type worker_dir: str
+
+        :return: Path of the merged stats file
+
+        :rtype: str
+    '''
+    os.makedirs(report_dir, exist_ok=True)
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    worker_files = sorted(glob.glob(worker_dir + '/worker_*.prof'))
+    for worker_file in worker_files:
+        stats.add(worker_file)
+        os.remove(worker_file)
+    try:
+        os.rmdir(worker_dir)
+    except OSError:
+        pass
+    stats_file = os.path.join(report_dir, name + '.prof')
+    stats.dump_stats(stats_file)
+    summary.write('Merged profile of {0} process(es)\n'.format(
+        len(worker_files) + 1))
+    stats.sort_stats('cumulative').print_stats(40)
+    stats.sort_stats('tottime').print_stats(20)
+    summary_file = os.path.join(report_dir, name + '_profile.txt')
+    with open(summary_file, 'w') as outfile:
+        outfile.write(summary.getvalue())
+    logger.info('Profile of {0} ({1} worker(s)) saved at {2}'.format(
+        name, len(worker_files), stats_file))
+    logger.info('Profile summary saved at {0}'.format(summary_file))
+    return stats_file
@@ -0,0 +1,233 @@
+# See LICENSE for details
+"""Writer for the sharded data of the HTML report"""
+import os
+import json
+import glob
+import shutil
+import hashlib
+
+#: Number of rows in each shard, which is also a page of the report tables
+shard_size = 500
+#: Number of characters of a log shown in the report tables
+log_limit = 2000
+
+
+class ReportWriter():
+    """
+    Writes the data shown by ``report.html`` as small javascript files, which
+    the page loads lazily one page at a time. The files are javascript (and not
+    plain JSON) so that the report also works when opened from the
+    filesystem, where browsers block fetching local files.
+
+    The writer remembers the digest of every file it wrote, so when the report
+    is regenerated during a run only the shards that changed are rewritten.
+    """
+
+    def __init__(self, report_dir):
+        """ Constructor.
+
+        :param report_dir: The reports directory of the work_dir
+
+        :type report_dir: str
+        """
+        self.report_dir = report_dir
+        self.data_dir = os.path.join(report_dir, 'report_data')
+        self.log_dir = os.path.join(report_dir, 'logs')
+        self.series = {}
+        self.digests = {}
+        self.rendered = False
+
+    def clear(self):
+        """
+        Remove the data and logs of a previous report.
+        """
+        for path in (self.data_dir, self.log_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(self.data_dir)
+        os.makedirs(self.log_dir)
+        self.digests = {}
+
+    def _write(self, path, content):
+        # Skip unchanged files and replace changed ones atomically, so that
+        # a browser refreshing the report never reads a partial file
+        digest = hashlib.md5(content.encode()).hexdigest()[:12]
+        if self.digests.get(path) != digest:
+            with open(path + '.tmp', 'w') as outfile:
+                outfile.write(content)
+            os.replace(path + '.tmp', path)
+            self.digests[path] = digest
+        return digest
+
+    def _write_js(self, file_name, call, *args):
+        return self._write(
+            os.path.join(self.data_dir, file_name),
+            'river_report.{0}({1});\n'.format(
+                call, ', '.join(json.dumps(arg) for arg in args)))
+
+    def write_series(self, name, rows):
+        """
+        Write the rows of a table as shards.
+
+        :param name: Name of the series of rows
+
+        :param rows: Rows of the table. Each row is a list of JSON serializable values.
+
+        :type name: str
+
+        :type rows: list
+
+        :return: Number of shards written
+
+        :rtype: int
+        """
+        versions = []
+        for start in range(0, len(rows), shard_size):
+            versions.append(
+                self._write_js('{0}_{1:05d}.js'.format(name, len(versions)),
+                               'add_shard', name, len(versions),
+                               rows[start:start + shard_size]))
+        for stale in glob.glob(os.path.join(self.data_dir, name + '_*.js')):
+            index = int(stale.rsplit('_', 1)[1][:-3])
+            if index >= len(versions):
+                os.remove(stale)
+                self.digests.pop(stale, None)
+        self.series[name] = {
+            'shards': len(versions),
+            'rows': len(rows),
+            'versions': versions
+        }
+        return len(versions)
+
+    def write_log(self, test, log):
+        """
+        Save the full log of a test.
+
+        :param test: Name of the test
+
+        :param log: Log of the test
+
+        :type test: str
+
+        :type log: str
+
+        :return: Path of the log relative to the reports directory
+
+        :rtype: str
+        """
+        file_name = test.replace(os.sep, '_') + '.log'
+        self._write(os.path.join(self.log_dir, file_name), log)
+        return 'logs/' + file_name
+
+    def write_summary(self, summary):
+        """
+        Write the summary of the report along with the number of shards in
+        each series.
+
+        :param summary: Counts and other details shown at the top of the report
+
+        :type summary: dict
+        """
+        manifest = dict(summary)
+        manifest['series'] = self.series
+        manifest['shard_size'] = shard_size
+        self._write_js('summary.js', 'set_summary', manifest)
+
+
+def truncate(log):
+    '''
+        Function to shorten a log for the report tables.
+
+        :param log: Log to shorten
+
+        :type log: str
+
+        :return: The shortened log and whether it was shortened
+
+        :rtype: tuple
+    '''
+    log = '' if log is None else str(log)
+    if len(log) <= log_limit:
+        return log, False
+    return log[:log_limit] + '\n...', True
+
+
+def test_rows(writer, test_dict):
+    '''
+        Function to create the rows of the log comparison table, grouped by
+        result. Tests which are yet to be compared have the result Pending.
+        The full logs of failing tests are saved separately.
+
+        :param writer: Writer of the report data
+
+        :param test_dict: Test List with the results
+
+        :type writer: ReportWriter
+
+        :type test_dict: dict
+
+        :return: Rows for each of the passed, failed, unavailable and pending series
+
+        :rtype: dict
+    '''
+    rows = {'passed': [], 'failed': [], 'unavailable': [], 'pending': []}
+    for test, attr in test_dict.items():
+        result = str(attr.get('result', 'Unavailable'))
+        if 'Unavailable' in result:
+            series = 'unavailable'
+        elif result == 'Pending':
+            series = 'pending'
+        elif result == 'Passed':
+            series = 'passed'
+        else:
+            series = 'failed'
+        log = attr.get('log')
+        if attr.get('harts'):
+            # Multi-hart dumps are compared per hart
+            log = ''.join(
+                'hart {0}: {1} ({2} instructions)\n'.format(
+                    hart, hart_attr['result'], hart_attr['num_instr'])
+                for hart, hart_attr in sorted(attr['harts'].items())) + str(
+                    log or '')
+        full_log = log
+        log, truncated = truncate(log)
+        log_file = None
+        if series == 'failed' or truncated:
+            log_file = writer.write_log(test, str(full_log))
+        rows[series].append([
+            test,
+            attr.get('num_instr'),
+            attr.get('work_dir'), result, log, log_file
+        ])
+    return rows
+
+
+def plugin_rows(json_data):
+    '''
+        Function to create the rows of a plugin results table from its pytest
+        report log.
+
+        :param json_data: Sanitised pytest JSON of the plugin
+
+        :type json_data: list
+
+        :return: Rows of the plugin results table
+
+        :rtype: list
+    '''
+    rows = []
+    for result in json_data or []:
+        if result.get('when') != 'call':
+            continue
+        try:
+            if result['outcome'] == 'failed':
+                message = result['longrepr']['reprcrash']['message']
+            else:
+                message = result['sections'][1][1]
+        except (KeyError, IndexError, TypeError):
+            message = ''
+        rows.append(
+            [result.get('outcome'),
+             result.get('nodeid'),
+             truncate(message)[0]])
+    return rows
@@ -5,14 +5,20 @@ import os
 import glob
 import shutil
 import datetime
+import time
 import importlib
 import configparser
-import lief
 #import filecmp
 import json
 import pytest
 from river_core.log import *
 import river_core.utils as utils
+import river_core.profiling as profiling
+import river_core.report as report
+import river_core.merge as merge
+import river_core.lockstep as lockstep
+import river_core.shard as sharding
+import river_core.history as hist
 from river_core.constants import *
 from river_core.__init__ import __version__
 from river_core.sim_hookspecs import *
@@ -26,28 +32,98 @@ yaml.default_flow_style = False
 yaml.allow_unicode = True
 yaml.compact(seq_seq=False, seq_map=False)
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 
 
 # Misc Helper Functions
+def trim_test_report(json_row):
+    '''
+        Function to keep only the fields of a pytest TestReport that are used
+        in the final report.
+
+        :param json_row: A TestReport row of the pytest report log
+
+        :type json_row: dict
+
+        :return: The trimmed row
+
+        :rtype: dict
+    '''
+    trimmed = {
+        '$report_type': 'TestReport',
+        'nodeid': json_row.get('nodeid'),
+        'when': json_row.get('when'),
+        'outcome': json_row.get('outcome'),
+        'duration': json_row.get('duration'),
+        # Only the captured logs of the first two sections are shown, and
+        # only up to the length that the report displays
+        'sections': [[name, report.truncate(text)[0]]
+                     for name, text in (json_row.get('sections') or [])[:2]],
+    }
+    try:
+        trimmed['longrepr'] = {
+            'reprcrash': {
+                'message': json_row['longrepr']['reprcrash']['message']
+            }
+        }
+    except (KeyError, TypeError):
+        trimmed['longrepr'] = None
+    return trimmed
+
+
 def sanitise_pytest_json(json):
     '''
-        Function to sanitise pytest JSONs, removes uncessary logs. 
+        Generator to sanitise pytest JSONs, removes uncessary logs. 
 
         :param json: JSON to sanitise 
 
-        :type json: list  
+        :type json: iterable
 
-        :return: A list of important json_data 
+        :return: The important json_data, row by row
 
-        :rtype: dict
+        :rtype: generator
     '''
-    return_data = []
     for json_row in json:
         # NOTE: Playing with fire here, pytest developers could (potentially) change this
         if json_row.get('$report_type', None) == 'TestReport':
-            return_data.append(json_row)
+            yield trim_test_report(json_row)
+
+
+def iter_pytest_json(json_file):
+    '''
+        Generator to lazily read the TestReport rows of a pytest report log.
+        Rows of other types are skipped without being parsed. A log which
+        cannot be read, or a malformed or partial line of it, is logged as a
+        warning and skipped rather than aborting the report.
+
+        :param json_file: Path of the report log generated by pytest-reportlog,
+            None for a missing log
+
+        :type json_file: str
+
+        :return: Trimmed TestReport rows
+
+        :rtype: generator
+    '''
+    if not json_file:
+        return
+    try:
+        with open(json_file, 'r') as json_lines:
+            for number, line in enumerate(json_lines, 1):
+                if '"TestReport"' not in line:
+                    continue
+                try:
+                    json_row = json.loads(line)
+                except ValueError as error:
+                    logger.warning("Skipping line {0} of {1}: {2}".format(
+                        number, json_file, error))
+                    continue
+                if json_row.get('$report_type', None) == 'TestReport':
+                    yield trim_test_report(json_row)
+    except OSError as error:
+        logger.warning("Couldn't read {0}, skipping it: {1}".format(
+            json_file, error))
 
-    return return_data
 
 def generate_coverage_report(output_dir, config, coverage_report,
                              coverage_rank_report, db_files):
@@ -116,7 +192,7 @@ def generate_coverage_report(output_dir, config, coverage_report,
 
 
 def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
-                    config, test_dict):
+                    config, test_dict, writer=None, refresh=0):
     '''
         Function to create an HTML report from the JSON files generated by individual plugins
 
@@ -132,18 +208,26 @@ def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
 
         :param test_dict: Test List YAML 
 
+        :param writer: Writer of an earlier report of this run. Only the data that changed since is rewritten.
+
+        :param refresh: Seconds after which an open report reloads its data, 0 once the run is complete
+
         :type output_dir: str
 
-        :type gen_json_data: dict 
+        :type gen_json_data: iterable
 
-        :type target_json_data: dict 
+        :type target_json_data: iterable
 
-        :type ref_json_data: dict 
+        :type ref_json_data: iterable
 
         :type config: configparser.SectionProxy 
 
         :type test_list: dict 
 
+        :type writer: river_core.report.ReportWriter
+
+        :type refresh: int
+
         :return: Final HTML path
 
         :rtype: str 
@@ -159,7 +243,7 @@ def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
 
     ## Get the proper stats about passed and failed test
     # NOTE: This is the place where you determine when your test passed fail, just add extra things to compare in the if condition if the results become to high
-    num_passed = num_total = num_unav = num_failed = 0
+    num_passed = num_total = num_unav = num_failed = num_pending = 0
     total_instr = 0
     for test in test_dict:
         num_total = num_total + 1
@@ -167,6 +251,9 @@ def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
             if 'Unavailable' in test_dict[test]['result']:
                 num_unav = num_unav + 1
                 continue
+            elif test_dict[test]['result'] == 'Pending':
+                num_pending = num_pending + 1
+                continue
             elif test_dict[test]['result'] == 'Passed':
                 num_passed = num_passed + 1
             else:
@@ -180,6 +267,7 @@ def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
     str_css_template = root + '/templates/style.css'
     report_file_name = 'report.html'
     report_dir = output_dir + '/reports/'
+    report_file_path = report_dir + '/' + report_file_name
     html_objects = {}
     html_objects['name'] = "RiVer Core Verification Report"
     html_objects['date'] = (datetime.datetime.now().strftime("%d-%m-%Y"))
@@ -189,32 +277,75 @@ def generate_report(output_dir, gen_json_data, target_json_data, ref_json_data,
     html_objects['dut'] = config['river_core']['target']
     html_objects['generator'] = config['river_core']['generator']
     html_objects['reference'] = config['river_core']['reference']
-    html_objects['test_dict'] = test_dict
-    html_objects['target_data'] = target_json_data
-    html_objects['ref_data'] = ref_json_data
-    html_objects['gen_data'] = gen_json_data
     html_objects['num_passed'] = num_passed
     html_objects['num_failed'] = num_failed
     html_objects['num_unav'] = num_unav
+    html_objects['num_pending'] = num_pending
     html_objects['total_instr'] = total_instr
+    html_objects['refresh'] = refresh
 
     if not os.path.exists(report_dir):
         os.makedirs(report_dir)
 
-    with open(str_report_template, "r") as report_template:
-        template = Template(report_template.read())
+    # The tables are written as shards which the report loads page by page
+    if writer is None:
+        writer = report.ReportWriter(report_dir)
+    if not writer.rendered:
+        writer.clear()
+    for series, rows in report.test_rows(writer, test_dict).items():
+        writer.write_series(series, rows)
+    writer.write_series('gen', report.plugin_rows(gen_json_data))
+    writer.write_series('target', report.plugin_rows(target_json_data))
+    writer.write_series('ref', report.plugin_rows(ref_json_data))
+    writer.write_summary(html_objects)
+
+    # The page itself is rendered once; later updates only touch the data
+    if not writer.rendered:
+        with open(str_report_template, "r") as report_template:
+            template = Template(report_template.read())
+
+        output = template.render(html_objects)
+
+        shutil.copyfile(str_css_template, report_dir + 'style.css')
+
+        with open(report_file_path, "w") as report_file:
+            report_file.write(output)
+        writer.rendered = True
+
+    if refresh:
+        logger.debug('Report updated at {0}'.format(report_file_path))
+    else:
+        logger.info('Final report saved at {0}'.format(report_file_path))
 
-    output = template.render(html_objects)
+    return report_file_path
 
-    shutil.copyfile(str_css_template, report_dir + 'style.css')
 
-    report_file_path = report_dir + '/' + report_file_name
-    with open(report_file_path, "w") as report:
-        report.write(output)
+def validate_test_list(test_list):
+    '''
+        Function to validate a test list against the test list schema. The
+        entries of the test list are replaced with their normalized versions.
 
-    logger.info('Final report saved at {0}'.format(report_file_path))
+        :param test_list: Test List to validate
 
-    return report_file_path
+        :type test_list: dict
+
+        :return: The validated and normalized Test List
+
+        :rtype: dict
+    '''
+    testschema = yaml.load(testlist_schema)
+    validator = YamlValidator(testschema)
+    validator.allow_unknown = False
+    for test, fields in test_list.items():
+        valid = validator.validate(fields)
+        if not valid:
+            logger.error('Test List Validation failed:')
+            error_list = validator.errors
+            for x in error_list:
+                logger.error('{0} [ {1} ] : {2}'.format(test, x, error_list[x]))
+            raise SystemExit(1)
+        test_list[test] = validator.normalized(fields, testschema)
+    return test_list
 
 
 def confirm():
@@ -275,7 +406,7 @@ def rivercore_clean(config_file, verbosity):
             logger.info(output_dir + ' directory deleted')
 
 
-def rivercore_generate(config_file, verbosity, filter_testgen):
+def rivercore_generate(config_file, verbosity, filter_testgen, shard=None):
     '''
         Function to generate the assembly programs using the plugin as configured in the config.ini.
 
@@ -283,9 +414,13 @@ def rivercore_generate(config_file, verbosity, filter_testgen):
 
         :param verbosity: Verbosity level for the framework
 
+        :param shard: K and N to run only the K-th of N shards of the generators, which are assigned in turn in the order of their names
+
         :type config_file: click.Path
 
         :type verbosity: str
+
+        :type shard: tuple
     '''
 
     logger.level(verbosity)
@@ -322,6 +457,21 @@ def rivercore_generate(config_file, verbosity, filter_testgen):
             logger.err("Test generator(s) passed does not exist in the config file")
         suite_list = list(suite_list_set.intersection(filter_testgen_set))
 
+    if shard is not None:
+        # The generator plugins choose the names and seeds of their tests, so
+        # a generator is the smallest part of the generation a shard can run
+        if shard[1] > len(suite_list):
+            logger.error('Cannot split {0} generators into {1} shards, use at most {0} shards for generate'.format(
+                len(suite_list), shard[1]))
+            raise SystemExit(1)
+        suite_list = [
+            suite for num, suite in enumerate(sorted(suite_list))
+            if num % shard[1] == shard[0] - 1
+        ]
+        logger.info('Shard {0}/{1} runs the generators: {2}'.format(
+            shard[0], shard[1], ', '.join(suite_list) or 'none'))
+
+    gen_seconds = {}
     for suite in suite_list:
 
         # for suite not in filter_testgen
@@ -362,6 +512,7 @@ def rivercore_generate(config_file, verbosity, filter_testgen):
                          str(txt))
             raise SystemExit(1)
 
+        start = time.time()
         generatorpm.hook.pre_gen(spec_config=config[suite],
                                  output_dir='{0}/{1}'.format(output_dir, suite))
         test_list.update(
@@ -375,29 +526,25 @@ def rivercore_generate(config_file, verbosity, filter_testgen):
 
         generatorpm.hook.post_gen(
             output_dir='{0}/{1}'.format(output_dir, suite))
+        gen_seconds[suite] = time.time() - start
 
     logger.info('Validating Generated Test-List')
-    testschema = yaml.load(testlist_schema)
-    validator = YamlValidator(testschema)
-    validator.allow_unknown = False
-    for test, fields in test_list.items():
-        valid = validator.validate(fields)
-        if not valid:
-            logger.error('Test List Validation failed:')
-            error_list = validator.errors
-            for x in error_list:
-                logger.error('{0} [ {1} ] : {2}'.format(test, x, error_list[x]))
-            raise SystemExit(1)
-        test_list[test] = validator.normalized(fields, testschema)
+    validate_test_list(test_list)
     logger.info('Test List Validated successfully')
     logger.info(f'Total Tests : {len(test_list)}')
     
-    test_list_file = output_dir + '/test_list.yaml'
+    test_list_file = sharding.shard_file(output_dir + '/test_list.yaml', shard)
     logger.info('Dumping generated Test-List at: ' + str(test_list_file))
     testfile = open(test_list_file, 'w')
     utils.yaml.dump(test_list, testfile)
     testfile.close()
 
+    history = hist.open_history(config, 'generate', shard)
+    if history:
+        for suite, seconds in gen_seconds.items():
+            history.record('generate', {None: seconds}, generator=suite)
+        history.close()
+
 
     # Open generation report in browser
     for suite in suite_list:
@@ -413,7 +560,9 @@ def rivercore_generate(config_file, verbosity, filter_testgen):
 
 
 def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
-                      ref_flags, compare, process_count, timeout):
+                      ref_flags, compare, process_count, timeout,
+                      report_interval=0, shard=None, shard_weights=None,
+                      timeout_factor=3):
     '''
 
         Function to compile generated assembly programs using the plugin as configured in the config.ini.
@@ -432,6 +581,18 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
 
         :param compare: Verbosity level for the framework
 
+        :param process_count: Number of processes used to compare the logs
+
+        :param timeout: Timeout period for tests
+
+        :param report_interval: Seconds between updates of the report while the logs are compared, 0 to only generate the final report
+
+        :param shard: K and N to run only the K-th of N shards of the test list, writing shard-local result files for :py:func:`rivercore_collect`
+
+        :param shard_weights: result_list.yaml of an earlier run, whose instruction counts balance the shards instead of the hash of the test names
+
+        :param timeout_factor: Multiple of the 99th percentile of the durations of a test in earlier runs set as its timeout in the test list, 0 to use only the timeout
+
         :type config_file: click.Path
 
         :type test_list: click.Path
@@ -445,6 +606,18 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
         :type ref_flags: click.Choice 
 
         :type compare: bool 
+
+        :type process_count: int
+
+        :type timeout: int
+
+        :type report_interval: int
+
+        :type shard: tuple
+
+        :type shard_weights: str
+
+        :type timeout_factor: float
     '''
     logger.level(verbosity)
     config = configparser.ConfigParser()
@@ -458,6 +631,50 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
     logger.info('****** Compilation Mode ******')
 
     output_dir = config['river_core']['work_dir']
+    history = hist.open_history(config, 'compile', shard)
+    compile_dict = utils.load_yaml(test_list)
+    if shard is not None:
+        weights = None
+        if shard_weights:
+            weights = sharding.result_weights(shard_weights)
+        compile_dict = sharding.shard_tests(compile_dict, shard, weights)
+    # The plugins run the tests in the order of the test list, so the longest
+    # start first and do not hold up the end of the run
+    estimates = history.estimates(compile_dict, ('dut', 'ref')) if history else {}
+    if estimates:
+        compile_dict = dict(
+            sorted(compile_dict.items(), key=lambda item: -estimates[item[0]]))
+        logger.info('Tests are run longest first, as estimated from {0}'.format(
+            history.path))
+        if timeout_factor > 0:
+            timeouts = history.timeouts(compile_dict, ('dut', 'ref'),
+                                        timeout_factor)
+            for test, seconds in timeouts.items():
+                if compile_dict[test].get('timeout') is None:
+                    compile_dict[test]['timeout'] = seconds
+            logger.info('{0} tests have a timeout of {1} times the 99th percentile of their earlier runs'.format(
+                len(timeouts), timeout_factor))
+    # Timeouts of the tests, set in the test list or from the history
+    test_timeouts = {
+        test: attr['timeout']
+        for test, attr in compile_dict.items()
+        if attr.get('timeout') is not None
+    }
+    if shard is not None or estimates:
+        user_test_list = test_list
+        test_list = sharding.shard_file(output_dir + '/compile_list.yaml',
+                                        shard)
+        # Saved by the round-trip dumper, which keeps the order of the tests
+        with open(test_list, 'w') as compile_file:
+            yaml.dump(compile_dict, compile_file)
+        logger.info('The plugins are given {0} in place of {1}'.format(
+            test_list, user_test_list))
+    if shard is not None:
+        logger.info('Shard {0}/{1} runs {2} tests from {3}'.format(
+            shard[0], shard[1], len(compile_dict), test_list))
+        if report_interval > 0:
+            logger.warning('The report of a shard is created by river_core collect, ignoring --report_interval')
+            report_interval = 0
     asm_gen = config['river_core']['generator']
     target_list = config['river_core']['target'].split(',')
     ref_list = config['river_core']['reference'].split(',')
@@ -480,6 +697,92 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
         coverage_config = config['coverage']
     else:
         coverage_config = None
+
+    def run_references():
+        # Returns the plugin manager and pytest report of the last reference
+        refpm = None
+        ref_json = None
+        for ref in ref_list:
+            if ref_flags:
+                logger.info("Reference Info")
+                logger.info("Reference Jobs : {0}".format(config[ref]['jobs']))
+                logger.info(
+                    "Reference Count (Times to run the test) : {0}".format(
+                        config[ref]['count']))
+                refpm = pluggy.PluginManager('dut')
+                refpm.add_hookspecs(DuTSpec)
+
+                path_to_module = os.path.abspath(config['river_core']['path_to_ref'])
+                plugin_ref = ref + '_plugin'
+                logger.info('Now loading {0}-target'.format(ref))
+                # Get ISA from river
+                isa = config['river_core']['isa']
+                config[ref]['isa'] = isa
+
+                abs_location_module = path_to_module + '/' + plugin_ref + '/' + plugin_ref + '.py'
+
+                try:
+                    logger.debug(
+                        "Loading module from {0}".format(abs_location_module))
+                    refpm_spec = importlib.util.spec_from_file_location(
+                        plugin_ref, abs_location_module)
+                    refpm_module = importlib.util.module_from_spec(refpm_spec)
+                    refpm_spec.loader.exec_module(refpm_module)
+
+                    # DuT Plugins
+                    # TODO:DOC: Naming for class in plugin
+                    plugin_class = "{0}_plugin".format(ref)
+                    class_to_call = getattr(refpm_module, plugin_class)
+                    refpm.register(class_to_call())
+                except:
+                    logger.error(
+                        "Sorry, requested plugin not found at location, please check config.ini"
+                    )
+                    raise SystemExit(1)
+
+            if ref_flags == 'init':
+                logger.debug('Single mode flag detected\nRunning init')
+                refpm.hook.init(ini_config=config[ref],
+                                test_list=test_list,
+                                work_dir=output_dir,
+                                coverage_config=coverage_config,
+                                plugin_path=path_to_module,
+                                timeout = timeout,
+                                test_timeouts = test_timeouts)
+            elif ref_flags == 'build':
+                logger.debug('Single mode flag detected\nRunning build')
+                refpm.hook.init(ini_config=config[ref],
+                                test_list=test_list,
+                                work_dir=output_dir,
+                                coverage_config=coverage_config,
+                                plugin_path=path_to_module,
+                                timeout = timeout,
+                                test_timeouts = test_timeouts)
+                refpm.hook.build()
+            elif ref_flags == 'run':
+                logger.debug('All modes detected\nRunning build')
+                refpm.hook.init(ini_config=config[ref],
+                                test_list=test_list,
+                                work_dir=output_dir,
+                                coverage_config=coverage_config,
+                                plugin_path=path_to_module,
+                                timeout = timeout,
+                                test_timeouts = test_timeouts)
+                refpm.hook.build()
+                ref_json = refpm.hook.run(module_dir=path_to_module)
+            else:
+                logger.warning('Ref Plugin disabled')
+        return refpm, ref_json
+
+    # The DuT plugins can stop a test at its first divergence only from
+    # reference dumps which are complete, so the references run first
+    ref_first = utils.str_2_bool(config['river_core'].get(
+        'kill_on_divergence', 'False')) and dut_flags == 'run' and \
+        ref_flags == 'run' and '' not in ref_list
+    if ref_first:
+        logger.info('Running the reference plugins first, so that the DuT plugins can stop the tests at their first divergence')
+        ref_dumps_since = time.time()
+        refpm, ref_json = run_references()
     if '' in target_list:
         logger.info('No targets configured, so moving on the reference')
     else:
@@ -495,6 +798,8 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
 
                 isa = config['river_core']['isa']
                 config[target]['isa'] = isa
+                if ref_first:
+                    config[target]['ref_dumps_since'] = str(ref_dumps_since)
                 path_to_module = os.path.abspath(config['river_core']['path_to_target'])
                 plugin_target = target + '_plugin'
                 logger.info('Now running on the Target Plugins')
@@ -530,7 +835,8 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
                                 work_dir=output_dir,
                                 coverage_config=coverage_config,
                                 plugin_path=path_to_module,
-                                timeout=timeout)
+                                timeout=timeout,
+                                test_timeouts=test_timeouts)
             elif dut_flags == 'build':
                 logger.debug('Single mode flag detected\nRunning build')
                 dutpm.hook.init(ini_config=config[target],
@@ -538,7 +844,8 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
                                 work_dir=output_dir,
                                 coverage_config=coverage_config,
                                 plugin_path=path_to_module,
-                                timeout=timeout)
+                                timeout=timeout,
+                                test_timeouts=test_timeouts)
                 dutpm.hook.build()
             elif dut_flags == 'run':
                 logger.debug('All modes enabled\nRunning run')
@@ -547,7 +854,8 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
                                 work_dir=output_dir,
                                 coverage_config=coverage_config,
                                 plugin_path=path_to_module,
-                                timeout=timeout)
+                                timeout=timeout,
+                                test_timeouts=test_timeouts)
                 dutpm.hook.build()
                 target_json = dutpm.hook.run(module_dir=path_to_module)
             else:
@@ -557,92 +865,68 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
         logger.info('No references, so exiting the framework')
         raise SystemExit(1)
     else:
-        for ref in ref_list:
-            if ref_flags:
-                logger.info("Reference Info")
-                logger.info("Reference Jobs : {0}".format(config[ref]['jobs']))
-                logger.info(
-                    "Reference Count (Times to run the test) : {0}".format(
-                        config[ref]['count']))
-                refpm = pluggy.PluginManager('dut')
-                refpm.add_hookspecs(DuTSpec)
+        if not ref_first:
+            refpm, ref_json = run_references()
 
-                path_to_module = os.path.abspath(config['river_core']['path_to_ref'])
-                plugin_ref = ref + '_plugin'
-                logger.info('Now loading {0}-target'.format(ref))
-                # Get ISA from river
-                isa = config['river_core']['isa']
-                config[ref]['isa'] = isa
-
-                abs_location_module = path_to_module + '/' + plugin_ref + '/' + plugin_ref + '.py'
-
-                try:
-                    logger.debug(
-                        "Loading module from {0}".format(abs_location_module))
-                    refpm_spec = importlib.util.spec_from_file_location(
-                        plugin_ref, abs_location_module)
-                    refpm_module = importlib.util.module_from_spec(refpm_spec)
-                    refpm_spec.loader.exec_module(refpm_module)
-
-                    # DuT Plugins
-                    # TODO:DOC: Naming for class in plugin
-                    plugin_class = "{0}_plugin".format(ref)
-                    class_to_call = getattr(refpm_module, plugin_class)
-                    refpm.register(class_to_call())
-                except:
-                    logger.error(
-                        "Sorry, requested plugin not found at location, please check config.ini"
-                    )
-                    raise SystemExit(1)
-
-            if ref_flags == 'init':
-                logger.debug('Single mode flag detected\nRunning init')
-                refpm.hook.init(ini_config=config[ref],
-                                test_list=test_list,
-                                work_dir=output_dir,
-                                coverage_config=coverage_config,
-                                plugin_path=path_to_module,
-                                timeout = timeout)
-            elif ref_flags == 'build':
-                logger.debug('Single mode flag detected\nRunning build')
-                refpm.hook.init(ini_config=config[ref],
-                                test_list=test_list,
-                                work_dir=output_dir,
-                                coverage_config=coverage_config,
-                                plugin_path=path_to_module,
-                                timeout = timeout)
-                refpm.hook.build()
-            elif ref_flags == 'run':
-                logger.debug('All modes detected\nRunning build')
-                refpm.hook.init(ini_config=config[ref],
-                                test_list=test_list,
-                                work_dir=output_dir,
-                                coverage_config=coverage_config,
-                                plugin_path=path_to_module,
-                                timeout = timeout)
-                refpm.hook.build()
-                ref_json = refpm.hook.run(module_dir=path_to_module)
-            else:
-                logger.warning('Ref Plugin disabled')
+        ## Indexing the ELFs once for the later stages
+        if dut_flags or ref_flags:
+            num_elf = utils.build_elf_indexes(utils.load_yaml(test_list))
+            logger.debug('Indexed {0} ELF files'.format(num_elf))
 
         ## Comparing Dumps
         if compare:
             test_dict = utils.load_yaml(test_list)
-            gen_json_data = []
-            target_json_data = []
-            ref_json_data = []
+            # Workers get copies, since the results are updated as they arrive
+            items = [(test, dict(attr)) for test, attr in test_dict.items()]
+            compare_estimates = history.estimates(
+                test_dict, ('compare',)) if history else {}
+            if compare_estimates:
+                items.sort(key=lambda item: -compare_estimates[item[0]])
+            writer = None
+            if report_interval > 0:
+                logger.info('Report will be updated every {0} seconds at {1}'.format(
+                    report_interval, output_dir + '/reports/report.html'))
+                for test in test_dict:
+                    test_dict[test]['result'] = 'Pending'
+                writer = report.ReportWriter(output_dir + '/reports/')
+                generate_report(output_dir, [], [], [], config, test_dict,
+                                writer, report_interval)
+            last_report = time.time()
+            compared = {}
+            compare_seconds = {}
             # parallelized
             success = True
-            items = test_dict.items()
-            with Pool(processes = process_count) as process_pool:
-                output = process_pool.map(logcomparison, items) #Collecting the return values from each process in the Pool
-            #Updating values
-            for i in output:
-                success = success and i[0]
-                test_dict[i[1]]['result'] = i[2]
-                test_dict[i[1]]['log'] = i[3]
-                test_dict[i[1]]['num_instr'] = i[4]
-            utils.save_yaml(test_dict, output_dir+'/result_list.yaml')
+            chunksize = max(1, min(64, len(items) // (process_count * 16)))
+            logger.start_queue()
+            with Pool(processes = process_count,
+                      initializer = profiling.init_worker) as process_pool:
+                #Updating values as each process in the Pool returns
+                for i in process_pool.imap_unordered(logcomparison, items,
+                                                     chunksize):
+                    success = success and i[0]
+                    test_dict[i[1]]['result'] = i[2]
+                    test_dict[i[1]]['log'] = i[3]
+                    test_dict[i[1]]['num_instr'] = i[4]
+                    if i[5] is not None:
+                        test_dict[i[1]]['harts'] = i[5]
+                    compare_seconds[i[1]] = i[6]
+                    compared[i[1]] = test_dict[i[1]]
+                    if writer and time.time() - last_report > report_interval:
+                        # Tests in the order they were compared, so that the
+                        # shards of the earlier results remain unchanged
+                        live_dict = dict(compared)
+                        live_dict.update((test, attr)
+                                         for test, attr in test_dict.items()
+                                         if test not in compared)
+                        generate_report(output_dir, [], [], [], config,
+                                        live_dict, writer, report_interval)
+                        last_report = time.time()
+                # Let the workers exit cleanly, so that any profile stats get written
+                process_pool.close()
+                process_pool.join()
+            utils.save_yaml(
+                test_dict,
+                sharding.shard_file(output_dir + '/result_list.yaml', shard))
             failed_dict = {}
             for test, attr in test_dict.items():
                 if attr['result'] == 'Failed' or 'Unavailable' in attr['result']:
@@ -650,21 +934,17 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
 
             if len(failed_dict) != 0:
                 logger.error(f'Total Tests that Failed :{len(failed_dict)}')
-                failed_dict_file = output_dir+'/failed_list.yaml'
+                failed_dict_file = sharding.shard_file(
+                    output_dir + '/failed_list.yaml', shard)
                 logger.error(f'Saving failed list of tests in {failed_dict_file}')
                 utils.save_yaml(failed_dict, failed_dict_file)
 
             # Start checking things after running the commands
             # Report generation starts here
-            # Target
-            # Move this into a function
             if target_json:
-                json_file = open(target_json[0] + '.json', 'r')
-                target_json_list = json_file.readlines()
-                json_file.close()
-                for line in target_json_list:
-                    target_json_data.append(json.loads(line))
+                target_json_file = target_json[0] + '.json'
             else:
+                target_json_file = None
                 logger.debug('Could not find a target_json file')
                 for test, attr in test_dict.items():
                     test_dict[test]['result'] = 'DUT Unavailable'
@@ -672,12 +952,9 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
                         'Resetting values in test_dict; Triggered by the lack of DuT values'
                     )
             if ref_json:
-                json_file = open(ref_json[0] + '.json', 'r')
-                ref_json_list = json_file.readlines()
-                json_file.close()
-                for line in ref_json_list:
-                    ref_json_data.append(json.loads(line))
+                ref_json_file = ref_json[0] + '.json'
             else:
+                ref_json_file = None
                 logger.debug('Could not find a reference_json file')
                 for test, attr in test_dict.items():
                     test_dict[test]['result'] = 'REF Unavailable'
@@ -687,28 +964,40 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
 
             # Need to an Gen json file for final report
             # TODO:CHECK: Only issue is that this can ideally be a wrong approach
-
-            try:
-                logger.info(
-                    "Checking for a generator json to create final report")
-                json_files = glob.glob(output_dir + '/.json/{0}*.json'.format(
-                    config['river_core']['generator']))
-                logger.debug(
-                    "Detected generated JSON Files: {0}".format(json_files))
-
+            logger.info("Checking for a generator json to create final report")
+            json_files = glob.glob(output_dir + '/.json/{0}*.json'.format(
+                config['river_core']['generator']))
+            logger.debug("Detected generated JSON Files: {0}".format(json_files))
+            if json_files:
                 # Can only get one file back
                 gen_json_file = max(json_files, key=os.path.getctime)
-                json_file = open(gen_json_file, 'r')
-                target_json_list = json_file.readlines()
-                json_file.close()
-                for line in target_json_list:
-                    gen_json_data.append(json.loads(line))
-
-            except:
+            else:
                 logger.warning("Couldn't find a generator JSON file")
-                gen_json_data = []
                 gen_json_file = []
 
+            # The logs are read lazily, one at a time, where they are used
+            gen_json_data = iter_pytest_json(gen_json_file)
+            target_json_data = iter_pytest_json(target_json_file)
+            ref_json_data = iter_pytest_json(ref_json_file)
+
+            if history:
+                dut_seconds = hist.plugin_durations(
+                    iter_pytest_json(target_json_file), test_dict)
+                regressions = history.regressions(dut_seconds, test_dict)
+                for test, speed, usual in regressions:
+                    logger.warning(
+                        '{0:<30} : DuT simulated {1:.0f} instructions/s, {2:.1f}x slower than the median of its earlier runs'
+                        .format(test, speed, usual / speed))
+                if regressions:
+                    logger.warning('DuT simulation was slower for {0} tests'.format(
+                        len(regressions)))
+                history.record('dut', dut_seconds, test_dict)
+                history.record(
+                    'ref',
+                    hist.plugin_durations(iter_pytest_json(ref_json_file),
+                                          test_dict), test_dict)
+                history.record('compare', compare_seconds, test_dict)
+
             if (target_json and ref_json and gen_json_file):
                 # See if space saver is enabled when we have all the data
                 dutpm.hook.post_run(test_dict=test_dict, config=config)
@@ -725,11 +1014,22 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
             gen_json_data = []
             target_json_data = []
             ref_json_data = []
+            writer = None
+            success = True
+
+        if history:
+            history.close()
+
+        if shard is not None:
+            logger.info('Run river_core collect once all the shards are done to create the report')
+            if not success:
+                raise SystemExit(1)
+            return
 
         logger.info("Now generating some good HTML reports for you")
         report_html = generate_report(output_dir, gen_json_data,
                                       target_json_data, ref_json_data, config,
-                                      test_dict)
+                                      test_dict, writer)
 
         # Check if web browser
         if utils.str_2_bool(config['river_core']['open_browser']):
@@ -743,7 +1043,129 @@ def rivercore_compile(config_file, test_list, coverage, verbosity, dut_flags,
             raise SystemExit(1)
 
 
-def rivercore_merge(verbosity, db_folders, output, config_file):
+def rivercore_collect(config_file, verbosity):
+    '''
+        Function to combine the shard-local files written by generate and
+        compile with --shard. The test lists of the generate shards are merged
+        into test_list.yaml, and the result lists of the compile shards into
+        result_list.yaml and failed_list.yaml, along with the report. The
+        history databases of the shards are merged into the history database.
+
+        :param config_file: Config.ini file of the shards
+
+        :param verbosity: Verbosity level for the framework
+
+        :type config_file: click.Path
+
+        :type verbosity: str
+    '''
+    logger.level(verbosity)
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    output_dir = config['river_core']['work_dir']
+    collected = False
+
+    def load_shards(path):
+        found = sharding.find_shards(path)
+        if found is None:
+            return None
+        count, paths = found
+        missing = [str(index) for index in range(1, count + 1)
+                   if index not in paths]
+        if missing:
+            logger.warning('Shards {0} of {1} are missing for {2}'.format(
+                ', '.join(missing), count, path))
+        merged = {}
+        for index, shard_path in sorted(paths.items()):
+            logger.info('Collecting ' + shard_path)
+            merged.update(utils.load_yaml(shard_path) or {})
+        return merged
+
+    test_dict = load_shards(output_dir + '/test_list.yaml')
+    if test_dict is not None:
+        validate_test_list(test_dict)
+        test_list_file = output_dir + '/test_list.yaml'
+        logger.info('Saving {0} tests in {1}'.format(len(test_dict),
+                                                     test_list_file))
+        utils.save_yaml(test_dict, test_list_file)
+        collected = True
+
+    test_dict = load_shards(output_dir + '/result_list.yaml')
+    if test_dict is not None:
+        result_file = output_dir + '/result_list.yaml'
+        logger.info('Saving the results of {0} tests in {1}'.format(
+            len(test_dict), result_file))
+        utils.save_yaml(test_dict, result_file)
+        failed_dict = {
+            test: attr
+            for test, attr in test_dict.items()
+            if attr.get('result') == 'Failed' or
+            'Unavailable' in str(attr.get('result'))
+        }
+        if failed_dict:
+            logger.error(f'Total Tests that Failed :{len(failed_dict)}')
+            utils.save_yaml(failed_dict, output_dir + '/failed_list.yaml')
+        elif os.path.exists(output_dir + '/failed_list.yaml'):
+            os.remove(output_dir + '/failed_list.yaml')
+        generate_report(output_dir, [], [], [], config, test_dict)
+        collected = True
+
+    if hist.merge_shards(config):
+        collected = True
+
+    if not collected:
+        logger.error('No shard files found in ' + output_dir)
+        raise SystemExit(1)
+
+
+def merge_common_files(files, common_dir, link=True, hardlink=False):
+    '''
+        Function to copy the common files of the merged tests. Files are
+        deduplicated by their contents, so the same file used by many tests
+        or databases is copied once. When different files share a name, the
+        last one is kept.
+
+        :param files: Common files of all the tests
+
+        :param common_dir: Directory where the common files are copied
+
+        :param link: Reflink the files when possible
+
+        :param hardlink: Hardlink the files when possible
+
+        :type files: list
+
+        :type common_dir: str
+
+        :type link: bool
+
+        :type hardlink: bool
+
+        :return: The files in the common directory
+
+        :rtype: list
+    '''
+    sources = list(dict.fromkeys(os.path.abspath(file) for file in files))
+    with ThreadPoolExecutor() as executor:
+        digests = list(executor.map(utils.file_digest, sources))
+    copied = {}
+    for source, digest in zip(sources, digests):
+        name = os.path.basename(source)
+        previous = copied.get(name)
+        if previous is not None:
+            if previous[1] == digest:
+                continue
+            logger.warning('{0} differs from {1}, keeping {0}'.format(
+                source, previous[0]))
+        utils.link_or_copy(source, os.path.join(common_dir, name), link,
+                           hardlink)
+        copied[name] = (source, digest)
+    return sorted(glob.glob(common_dir + '/*'))
+
+
+def rivercore_merge(verbosity, db_folders, output, config_file,
+                    process_count=8, link=True, link_only=False, fan_in=0,
+                    cache_dir=None, incremental=False, hardlink=False):
     '''
         Work in Progress
 
@@ -757,6 +1179,20 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
 
         :param config_file: Config.ini file for generation
 
+        :param process_count: Number of threads copying the tests and of coverage merges run in parallel
+
+        :param link: Reflink the files of the tests instead of copying them when possible
+
+        :param link_only: Only merge the test lists and coverage, with the tests pointing into the source databases
+
+        :param fan_in: Number of coverage databases merged together by the plugin, 0 to merge all of them at once
+
+        :param cache_dir: Directory of the intermediate coverage databases, next to the output by default
+
+        :param incremental: Add the databases to an existing output, merging only the tests and coverage databases which are new or changed
+
+        :param hardlink: Hardlink the files of the tests when reflinks are not supported, sharing them with the source databases
+
         :type verbosity: str
 
         :type db_folders: tuple 
@@ -764,6 +1200,20 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
         :type output: str 
 
         :type config_file: click.Path
+
+        :type process_count: int
+
+        :type link: bool
+
+        :type link_only: bool
+
+        :type fan_in: int
+
+        :type cache_dir: str
+
+        :type incremental: bool
+
+        :type hardlink: bool
     '''
 
     logger.level(verbosity)
@@ -779,7 +1229,16 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
     logger.info('****** Merge Mode ******')
 
     output = os.path.abspath(output)
-    if os.path.exists(output):
+    manifest = None
+    if incremental and os.path.exists(output):
+        manifest = merge.load_manifest(output)
+        if manifest is None:
+            logger.error(
+                '{0} has no {1}, only outputs of a previous merge can be merged into'
+                .format(output, merge.manifest_file))
+            raise SystemExit(1)
+        logger.info('Merging incrementally into {0}'.format(output))
+    elif os.path.exists(output):
         logger.info('Previous directory with same name detected\nOverwrite?')
         res = confirm()
         if res:
@@ -788,47 +1247,85 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
         else:
             logger.info('Alright\nBailing out.')
             raise SystemExit(1)
-    os.makedirs(output)
     asm_dir = output + '/asm'
     common_dir = output + '/common'
     coverage_dir = output + '/final_coverage'
     report_dir = output + '/reports'
-    # Create the ASM dir
-    os.makedirs(asm_dir)
-    # Create the Common dir
-    os.makedirs(common_dir)
+    if manifest is None:
+        os.makedirs(output)
+        manifest = {'databases': {}, 'coverage': [], 'coverage_html': []}
+        # Create the final test_list dict
+        test_list = {}
+    else:
+        # Start from the tests merged earlier
+        test_list = utils.load_yaml(output + '/test_list.yaml')
+    if not link_only:
+        # Create the ASM dir
+        os.makedirs(asm_dir, exist_ok=True)
+        # Create the Common dir
+        os.makedirs(common_dir, exist_ok=True)
     # Create the Common dir
-    os.makedirs(coverage_dir)
+    os.makedirs(coverage_dir, exist_ok=True)
     # Create the Report dir
-    os.makedirs(report_dir)
-    # Create the final test_list dict
-    test_list = {}
+    os.makedirs(report_dir, exist_ok=True)
     # Coverage DB list
     coverage_database = []
     coverage_html = []
     coverage_ranked_html = []
-    # Copy the files
-    # TODO: Check this
+    # Work dirs of the tests to copy and the common files they use
+    copies = []
+    extra_files = []
+    extra_tests = []
+    missing = []
+    num_unchanged = 0
     for db_folder in db_folders:
         file_path = os.path.abspath(db_folder)
         folder_yaml = utils.load_yaml(file_path + '/test_list.yaml')
+        merged_tests = manifest['databases'].get(file_path, {}).get('tests', {})
+        signatures = {}
         for test in folder_yaml.keys():
+            signatures[test] = merge.test_signature(folder_yaml[test])
+            # Skip the tests merged earlier which did not change
+            if merged_tests.get(test) == signatures[test] and test in test_list:
+                num_unchanged = num_unchanged + 1
+                continue
             test_list[test] = {}
-            test_asm = asm_dir + '/' + test
-            test_common = common_dir + '/' + test
-            # Copy the ASM folder
-            ret_val = os.system('cp -r -f {0} {1}'.format(
-                folder_yaml[test]['work_dir'], test_asm))
-            if ret_val != 0:
-                logger.error('Failed to copy files\nFiles donot exist')
-                raise SystemExit(1)
+            if link_only:
+                # Point to the files in the source database
+                test_asm = os.path.abspath(folder_yaml[test]['work_dir'])
+                test_files = [
+                    os.path.abspath(folder_yaml[test].get(
+                        'asm_file', test_asm + '/' + test + '.S')),
+                    os.path.abspath(folder_yaml[test].get(
+                        'linker_file', test_asm + '/' + test + '.ld'))
+                ]
+                extra_compile = [
+                    os.path.abspath(extra)
+                    for extra in folder_yaml[test].get('extra_compile') or []
+                ]
+                missing.extend(
+                    path for path in [test_asm] + test_files + extra_compile
+                    if not os.path.exists(path))
+            else:
+                test_asm = asm_dir + '/' + test
+                test_files = [
+                    test_asm + '/' + test + '.S', test_asm + '/' + test + '.ld'
+                ]
+                # Copy the ASM folder
+                if not os.path.isdir(folder_yaml[test]['work_dir']):
+                    logger.error('Failed to copy files\nFiles donot exist')
+                    raise SystemExit(1)
+                # A changed test replaces the earlier copy
+                if os.path.exists(test_asm):
+                    shutil.rmtree(test_asm)
+                copies.append((folder_yaml[test]['work_dir'], test_asm))
             # Check if something common is there
-            if folder_yaml[test].get('extra_compile'):
-                for extra in range(0, len(folder_yaml[test]['extra_compile'])):
-                    # Keep this separate right now
-                    shutil.copy(folder_yaml[test]['extra_compile'][extra],
-                                common_dir)
-                test_list[test]['extra_compile'] = glob.glob(common_dir + '/*')
+            if link_only:
+                if extra_compile:
+                    test_list[test]['extra_compile'] = extra_compile
+            elif folder_yaml[test].get('extra_compile'):
+                extra_files.extend(folder_yaml[test]['extra_compile'])
+                extra_tests.append(test)
             # Copying things from test_list
             test_list[test]['cc'] = folder_yaml[test]['cc']
             test_list[test]['cc_args'] = folder_yaml[test]['cc_args']
@@ -837,11 +1334,10 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
             test_list[test]['mabi'] = folder_yaml[test]['mabi']
             test_list[test]['march'] = folder_yaml[test]['march']
             test_list[test]['result'] = folder_yaml[test]['result']
-            test_list[test]['asm_file'] = test_asm + '/' + test + '.S'
-            test_list[test]['linker_file'] = test_asm + '/' + test + '.ld'
+            test_list[test]['asm_file'] = test_files[0]
+            test_list[test]['linker_file'] = test_files[1]
             test_list[test]['work_dir'] = test_asm
-
-        logger.info('Copied ASM and other necessary files')
+        manifest['databases'][file_path] = {'tests': signatures}
 
         # Check coverage info
         # The plugins should probably take care of this part, they'll get aresultess to the dbs_folder
@@ -876,6 +1372,37 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
         else:
             logger.warning('No DB files found in {0}'.format(file_path))
 
+    if missing:
+        for path in missing:
+            logger.error('{0} does not exist'.format(path))
+        logger.error('Cannot merge, {0} files of the tests are missing'.format(
+            len(missing)))
+        raise SystemExit(1)
+
+    # Copy the tests in parallel
+    with ThreadPoolExecutor(max_workers=process_count) as executor:
+        futures = [
+            executor.submit(utils.copy_tree, src, dst, link, hardlink)
+            for src, dst in copies
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except OSError as err:
+                logger.error('Failed to copy files\n{0}'.format(err))
+                raise SystemExit(1)
+    # The common files are shared by most tests, copy each of them once
+    if extra_tests:
+        extra_compile = merge_common_files(extra_files, common_dir, link,
+                                           hardlink)
+        for test in extra_tests:
+            test_list[test]['extra_compile'] = list(extra_compile)
+    if copies:
+        logger.info('Copied ASM and other necessary files')
+    if num_unchanged:
+        logger.info('{0} tests were merged earlier and are unchanged'.format(
+            num_unchanged))
+
     dutpm = pluggy.PluginManager('dut')
     dutpm.add_hookspecs(DuTSpec)
 
@@ -903,11 +1430,62 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
         raise SystemExit(1)
 
     # Perform Merge only if coverage enabled
+    final_html = None
+    extension = merge.db_extension(target)
+    # The previous merged database is moved here while it is merged again
+    previous_dir = output + '/.previous_coverage'
+    coverage_html = list(
+        dict.fromkeys(manifest['coverage_html'] + coverage_html))
     if (utils.str_2_bool(config['coverage']['code']) or
             utils.str_2_bool(config['coverage']['functional'])):
-        final_html = dutpm.hook.merge_db(db_files=coverage_database,
-                                         config=config,
-                                         output_db=output)
+        if manifest['coverage']:
+            # Only the databases not merged earlier are merged into the
+            # previous merged database
+            merged_before = [tuple(entry) for entry in manifest['coverage']]
+            coverage_database = [
+                db for db in coverage_database
+                if tuple(merge.db_stat(db)) not in merged_before
+            ]
+            previous_db = None
+            if extension:
+                previous_db = (merge.find_db(previous_dir, extension) or
+                               merge.find_db(output, extension))
+            if not coverage_database:
+                logger.info('No new coverage databases to merge')
+            elif previous_db:
+                os.makedirs(previous_dir + '/final_coverage', exist_ok=True)
+                coverage_database.insert(
+                    0,
+                    shutil.move(
+                        previous_db, previous_dir + '/final_coverage/' +
+                        os.path.basename(previous_db)))
+            else:
+                logger.warning(
+                    'Merged coverage database not found in {0}, merging only the new databases'
+                    .format(coverage_dir))
+        if coverage_database:
+            if fan_in > 1 and extension and len(coverage_database) > fan_in:
+                if cache_dir is None:
+                    cache_dir = os.path.join(os.path.dirname(output),
+                                             '.river_core_merge_cache')
+                try:
+                    final_html = merge.tree_merge(dutpm, config,
+                                                  coverage_database, output,
+                                                  extension, fan_in,
+                                                  process_count,
+                                                  os.path.abspath(cache_dir))
+                except RuntimeError as err:
+                    logger.error(str(err))
+                    raise SystemExit(1)
+            else:
+                final_html = dutpm.hook.merge_db(db_files=coverage_database,
+                                                 config=config,
+                                                 output_db=output)
+            manifest['coverage'].extend(
+                merge.db_stat(db) for db in coverage_database
+                if not db.startswith(previous_dir))
+            if os.path.exists(previous_dir):
+                shutil.rmtree(previous_dir)
 
     # Create final test list
     test_list_file = output + '/test_list.yaml'
@@ -916,22 +1494,27 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
     testfile.close()
     logger.info('Merged Test list is generated and available at {0}'.format(
         test_list_file))
+    manifest['coverage_html'] = coverage_html
+    merge.save_manifest(output, manifest)
 
     # Remove existing files
-    logger.info('The following directories will be removed : ' +
-                str(db_folders))
-    logger.info('Hope you have took everything you want')
-    res = confirm()
-    if res:
-        for db_file in db_folders:
-            shutil.rmtree(db_file)
-            logger.info(db_file + ' directory deleted')
+    if link_only:
+        logger.info('The merged test list points into ' + str(db_folders) +
+                    ', which are kept')
     else:
-        logger.info('Exiting framework.\nIndividual folders still exist')
+        logger.info('The following directories will be removed : ' +
+                    str(db_folders))
+        logger.info('Hope you have took everything you want')
+        res = confirm()
+        if res:
+            for db_file in db_folders:
+                shutil.rmtree(db_file)
+                logger.info(db_file + ' directory deleted')
+        else:
+            logger.info('Exiting framework.\nIndividual folders still exist')
 
     # Coverage Report Generations
-    if (utils.str_2_bool(config['coverage']['code']) or
-            utils.str_2_bool(config['coverage']['functional'])):
+    if final_html:
         report_html = generate_coverage_report(report_dir, config,
                                                final_html[0][0],
                                                final_html[0][1], coverage_html)
@@ -944,31 +1527,47 @@ def rivercore_merge(verbosity, db_folders, output, config_file):
             logger.info("Couldn't open the browser")
 
 #Helper function for parallel processing
-#Returns success,test,attr['result'],attr['log'],attr['numinstr']
+#Returns success,test,attr['result'],attr['log'],attr['numinstr'],attr['harts']
 def logcomparison(item):
+    start = time.perf_counter()
     test, attr = item
     test_wd = attr['work_dir']
     is_self_checking = attr['self_checking']
-    if not is_self_checking:
-        if not os.path.isfile(test_wd + '/dut.dump'):
+    harts = None
+    # The dumps may have been saved compressed
+    dut_dump = utils.find_dump(test_wd + '/dut.dump')
+    ref_dump = utils.find_dump(test_wd + '/ref.dump')
+    lockstep_result = os.path.join(test_wd, lockstep.result_file)
+    if not is_self_checking and os.path.isfile(lockstep_result) and \
+            dut_dump is None:
+        # The dumps were compared while the simulators ran
+        lockstep_dict = utils.load_yaml(lockstep_result)
+        result = lockstep_dict['result']
+        log = lockstep_dict['log']
+        insnsize = lockstep_dict['num_instr']
+    elif not is_self_checking:
+        if dut_dump is None:
             logger.error(f'{test:<30} : DUT dump is missing')
-            return False, test, 'Unavailable', "DUT dump is missing", None
-        if not os.path.isfile(test_wd + '/ref.dump'):
+            return False, test, 'Unavailable', "DUT dump is missing", None, None, time.perf_counter() - start
+        if ref_dump is None:
             logger.error(f'{test:<30} : REF dump is missing')
-            return False, test, 'Unavailable', 'REF dump is missing', None
-        result, log, insnsize = utils.compare_dumps(test_wd + '/dut.dump', test_wd + '/ref.dump')
+            return False, test, 'Unavailable', 'REF dump is missing', None, None, time.perf_counter() - start
+        # Tests with compare_skip have raw dumps, trimmed while comparing
+        skip = utils.test_skip(attr)
+        result, log, insnsize, harts = utils.compare_harts(dut_dump, ref_dump, skip)
     else:
-        if not os.path.isfile(test_wd + '/dut.signature'):
+        dut_signature = utils.find_dump(test_wd + '/dut.signature')
+        if dut_signature is None:
             logger.error(f'{test:<30} : DUT signature is missing')
-            return False, test, 'Unavailable',"DUT signature is missing", None
-        result, log = utils.self_check(test_wd + '/dut.signature')
-        insnsize = utils.get_file_size(test_wd + '/dut.dump')
+            return False, test, 'Unavailable',"DUT signature is missing", None, None, time.perf_counter() - start
+        result, log = utils.self_check(dut_signature)
+        insnsize = utils.count_lines(dut_dump or test_wd + '/dut.dump')
     if result == 'Passed':
         logger.info(f"{test:<30} : TEST {result.upper()}")
-        return True, test, result, log, insnsize
+        return True, test, result, log, insnsize, harts, time.perf_counter() - start
     else:
         logger.error(f"{test:<30} : TEST {result.upper()}")
-        return False, test, result, log, insnsize
+        return False, test, result, log, insnsize, harts, time.perf_counter() - start
 def rivercore_setup(config, dut, gen, ref, verbosity):
     '''
         Function to generate sample plugins 
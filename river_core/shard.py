@@ -0,0 +1,206 @@
+# See LICENSE for details
+"""Deterministic splitting of a regression into shards run on separate hosts"""
+import os
+import re
+import glob
+import hashlib
+from river_core.log import logger
+import river_core.utils as utils
+
+# Shard given on the command line as K/N
+_shard_regex = re.compile(r'^\s*(\d+)\s*/\s*(\d+)\s*$')
+# Shard in the name of a shard-local file
+_suffix_regex = re.compile(r'\.shard-(\d+)-of-(\d+)\.\w+$')
+
+
+def parse_shard(spec):
+    '''
+        Function to read a shard given as K/N, the K-th of N shards.
+
+        :param spec: The shard, like 2/8
+
+        :type spec: str
+
+        :return: K and N, None when no shard is given
+
+        :rtype: tuple
+    '''
+    if not spec:
+        return None
+    match = _shard_regex.match(spec)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        logger.error('Invalid shard {0}, expected K/N with 1 <= K <= N'.format(
+            spec))
+        raise SystemExit(1)
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_suffix(shard):
+    '''
+        Function to find the suffix of the shard-local files of a shard.
+
+        :param shard: K and N of the shard
+
+        :type shard: tuple
+
+        :return: Suffix added before the extension, empty without a shard
+
+        :rtype: str
+    '''
+    if shard is None:
+        return ''
+    return '.shard-{0}-of-{1}'.format(*shard)
+
+
+def shard_file(path, shard):
+    '''
+        Function to find the shard-local version of a file of the work_dir.
+
+        :param path: Path of the file, like work_dir/result_list.yaml
+
+        :param shard: K and N of the shard
+
+        :type path: str
+
+        :type shard: tuple
+
+        :return: The path with the shard suffix, like work_dir/result_list.shard-2-of-8.yaml
+
+        :rtype: str
+    '''
+    root, extension = os.path.splitext(path)
+    return root + shard_suffix(shard) + extension
+
+
+def stable_hash(name):
+    '''
+        Function to hash a name the same way on every host and run.
+
+        :param name: Name of the test
+
+        :type name: str
+
+        :rtype: int
+    '''
+    return int(hashlib.sha1(name.encode()).hexdigest()[:12], 16)
+
+
+def assign(names, count, weights=None):
+    '''
+        Function to assign names to shards. Without weights a name goes to the
+        shard of its stable hash. With weights, like the instructions or
+        runtime of the tests in an earlier run, the heaviest names are placed
+        first on the lightest shard so that the shards take similar times.
+        Names without a weight get the median weight. Both are deterministic
+        for the same names and weights.
+
+        :param names: Names to assign, like the tests of a test list
+
+        :param count: Number of shards
+
+        :param weights: Weight of the names
+
+        :type names: list
+
+        :type count: int
+
+        :type weights: dict
+
+        :return: Shard of each name, from 1
+
+        :rtype: dict
+    '''
+    if not weights:
+        return {name: stable_hash(name) % count + 1 for name in names}
+    known = sorted(weight for name, weight in weights.items() if weight)
+    default = known[len(known) // 2] if known else 1
+    loads = [0] * count
+    shards = {}
+    for name in sorted(names,
+                       key=lambda name: (-(weights.get(name) or default),
+                                         stable_hash(name), name)):
+        shard = min(range(count), key=lambda shard: (loads[shard], shard))
+        loads[shard] += weights.get(name) or default
+        shards[name] = shard + 1
+    return shards
+
+
+def shard_tests(test_dict, shard, weights=None):
+    '''
+        Function to select the tests of a shard from a test list.
+
+        :param test_dict: The test list
+
+        :param shard: K and N of the shard
+
+        :param weights: Weight of the tests for balancing, see :py:func:`assign`
+
+        :type test_dict: dict
+
+        :type shard: tuple
+
+        :type weights: dict
+
+        :return: Test list of the shard
+
+        :rtype: dict
+    '''
+    index, count = shard
+    shards = assign(list(test_dict), count, weights)
+    return {
+        test: attr
+        for test, attr in test_dict.items() if shards[test] == index
+    }
+
+
+def result_weights(result_list):
+    '''
+        Function to read the weights of the tests from the result list of an
+        earlier run, as the number of instructions they executed.
+
+        :param result_list: Path of the result_list.yaml
+
+        :type result_list: str
+
+        :return: Weight of each test
+
+        :rtype: dict
+    '''
+    weights = {}
+    for test, attr in utils.load_yaml(result_list).items():
+        if isinstance(attr, dict) and isinstance(attr.get('num_instr'), int):
+            weights[test] = attr['num_instr']
+    return weights
+
+
+def find_shards(path):
+    '''
+        Function to find the shard-local versions of a file of the work_dir.
+
+        :param path: Path of the file, like work_dir/result_list.yaml
+
+        :type path: str
+
+        :return: Number of shards and the path of each shard found, None when
+            there are no shard-local files
+
+        :rtype: tuple
+    '''
+    root, extension = os.path.splitext(path)
+    found = {}
+    counts = set()
+    for shard_path in glob.glob(glob.escape(root) + '.shard-*-of-*' +
+                                extension):
+        match = _suffix_regex.search(shard_path)
+        if match:
+            counts.add(int(match.group(2)))
+            found[(int(match.group(1)), int(match.group(2)))] = shard_path
+    if not counts:
+        return None
+    if len(counts) > 1:
+        logger.error('Shard files of {0} from runs with {1} shards'.format(
+            path, ' and '.join(map(str, sorted(counts)))))
+        raise SystemExit(1)
+    count = counts.pop()
+    paths = {index: found[(index, count)] for index, _ in sorted(found)}
+    return count, paths
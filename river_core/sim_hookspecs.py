@@ -78,7 +78,7 @@ class DuTSpec(object):
 
     @dut_hookspec
     def init(self, ini_config, test_list, work_dir, coverage_config,
-             plugin_path, timeout):
+             plugin_path, timeout, test_timeouts):
         """ 
         This stage is used to capture configurations from the input ``config.ini`` and build
         and set up the environment. If a core generator is the target, then this stage can be used to
@@ -96,6 +96,13 @@ class DuTSpec(object):
 
         :param plugin_path: Path to the plugin module to be loaded  
 
+        :param timeout: Timeout period for each test, -1 for none
+
+        :param test_timeouts: Timeout of the tests which have one, set in the
+            test list or by river_core compile from the durations of their
+            earlier runs. It overrides the timeout for those tests. Plugins
+            which do not take this argument are still called.
+
         :type ini_config: dict 
 
         :type test_list: str  
@@ -106,6 +113,10 @@ class DuTSpec(object):
 
         :type plugin_path: str  
 
+        :type timeout: int
+
+        :type test_timeouts: dict
+
         """
 
     @dut_hookspec
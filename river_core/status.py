@@ -0,0 +1,514 @@
+# See LICENSE for details
+"""Status of the tests of a regression, from the files in their work_dirs"""
+import os
+import sys
+import csv
+import json
+import time
+import struct
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import click
+from jinja2 import Template
+import river_core.utils as utils
+from river_core.log import logger
+from river_core.__init__ import __version__
+
+#: States of a test, in the order a test goes through them. The last two are
+#: found from the result_list.yaml written by the compare stage.
+states = [
+    'not compiled', 'compiled', 'simulating', 'ref error', 'tohost',
+    'compared', 'failed', 'unavailable'
+]
+
+# Address of tohost for each ELF, with the mtime it was read at
+_tohost_cache = {}
+
+
+def last_line(file, block_size=4096):
+    '''
+        Function to read the last line of a file without reading the whole
+        file. Blocks are read backwards from the end until a full line is
+        found, so the cost does not depend on the size of the file.
+
+        :param file: Path of the file
+
+        :param block_size: Number of bytes read at a time
+
+        :type file: str
+
+        :type block_size: int
+
+        :return: The last non-empty line, an empty string for an empty file
+
+        :rtype: str
+    '''
+    if utils.dump_compression(file) is not None:
+        data = utils.read_dump_tail(file).rstrip(b'\r\n')
+        return data.rsplit(b'\n', 1)[-1].decode(errors='replace')
+    with open(file, 'rb') as infile:
+        position = infile.seek(0, os.SEEK_END)
+        data = b''
+        while position > 0:
+            step = min(block_size, position)
+            position = position - step
+            infile.seek(position)
+            data = infile.read(step) + data
+            stripped = data.rstrip(b'\r\n')
+            if b'\n' in stripped:
+                return stripped.rsplit(b'\n', 1)[1].decode(errors='replace')
+        return data.rstrip(b'\r\n').decode(errors='replace')
+
+
+def tohost_address(elf_file):
+    '''
+        Function to find the address of tohost in an ELF, formatted as it is
+        matched against the dumps. The address comes from the ELF index of
+        the work_dir and is cached until the ELF is modified.
+
+        :param elf_file: Path of the ELF file
+
+        :type elf_file: str
+
+        :return: The address, None when the ELF has no tohost
+
+        :rtype: str
+    '''
+    mtime = os.stat(elf_file).st_mtime_ns
+    cached = _tohost_cache.get(elf_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    value = utils.elf_symbol(elf_file, 'tohost')
+    address = None if value is None else '0x{:08X}'.format(value)
+    _tohost_cache[elf_file] = (mtime, address)
+    return address
+
+
+def test_status(test, attr, hart_id):
+    '''
+        Function to find how far a test has progressed. A test has reached
+        tohost when the last record of its DuT dump (and of the reference dump,
+        when the DuT dump is dut.dump) writes to tohost.
+
+        :param test: Name of the test
+
+        :param attr: Entry of the test in the test list
+
+        :param hart_id: Hart whose rtl_<hart_id>.dump is checked when there is no dut.dump
+
+        :type test: str
+
+        :type attr: dict
+
+        :type hart_id: str
+
+        :return: State of the test and a message when it has not reached tohost
+
+        :rtype: tuple
+    '''
+    work_dir = attr['work_dir']
+    elf_file = work_dir + '/' + test + '.elf'
+    if not os.path.exists(elf_file):
+        return 'not compiled', test + ' has not compiled.\n'
+    dump_file = utils.find_dump(work_dir + '/dut.dump')
+    ref_file = utils.find_dump(work_dir + '/ref.dump') or work_dir + '/ref.dump'
+    if dump_file is None:
+        dump_file = utils.find_dump(work_dir + '/rtl_' + str(hart_id) +
+                                    '.dump')
+        ref_file = None
+        if dump_file is None:
+            return 'compiled', test + ' rtl dump not created'
+    tohost = tohost_address(elf_file)
+    if tohost is None:
+        return 'simulating', test + ' has no tohost symbol'
+    tohost = tohost.lower()
+    if tohost not in last_line(dump_file).lower():
+        return 'simulating', test + ' tohost is not written to yet'
+    if ref_file is not None:
+        if not os.path.exists(ref_file) or tohost not in last_line(
+                ref_file).lower():
+            return 'ref error', test + ' spike simulation has some errors'
+    return 'tohost', ''
+
+
+def check_tests(test_dict, hart_id, process_count=None):
+    '''
+        Function to find the status of all the tests of a test list in
+        parallel. Checking a test is dominated by file system calls, so
+        threads are used.
+
+        :param test_dict: Test list
+
+        :param hart_id: Hart whose dump is checked when there is no dut.dump
+
+        :param process_count: Number of threads, chosen by the executor when None
+
+        :type test_dict: dict
+
+        :type hart_id: str
+
+        :type process_count: int
+
+        :return: State and message of each test
+
+        :rtype: dict
+    '''
+
+    def check(item):
+        test, attr = item
+        try:
+            return test, test_status(test, attr, hart_id)
+        except (OSError, ValueError, struct.error) as err:
+            return test, ('simulating', '{0} could not be checked: {1}'.format(
+                test, err))
+
+    with ThreadPoolExecutor(max_workers=process_count) as executor:
+        return dict(executor.map(check, test_dict.items()))
+
+
+def status_rows(test_dict, test_states):
+    '''
+        Function to create a row for each test with its status.
+
+        :param test_dict: Test list
+
+        :param test_states: State and message of each test, as returned by :func:`check_tests`
+
+        :type test_dict: dict
+
+        :type test_states: dict
+
+        :return: Rows with the test, state, message and work_dir of each test
+
+        :rtype: list
+    '''
+    return [{
+        'test': test,
+        'state': test_states[test][0],
+        'message': test_states[test][1].strip(),
+        'work_dir': attr['work_dir']
+    } for test, attr in test_dict.items()]
+
+
+def write_status(rows, output, output_format):
+    '''
+        Function to save the status of the tests.
+
+        :param rows: Rows from :func:`status_rows`
+
+        :param output: Path of the file to write
+
+        :param output_format: json or csv
+
+        :type rows: list
+
+        :type output: str
+
+        :type output_format: str
+    '''
+    with open(output, 'w', newline='') as outfile:
+        if output_format == 'csv':
+            writer = csv.DictWriter(
+                outfile, fieldnames=['test', 'state', 'message', 'work_dir'])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, outfile, indent=1)
+
+
+def write_html(rows, counts, test_list, output):
+    '''
+        Function to save an HTML page with the number of tests in each state
+        and the tests which have not reached tohost.
+
+        :param rows: Rows from :func:`status_rows`
+
+        :param counts: Number of tests in each state
+
+        :param test_list: Test list which was checked
+
+        :param output: Path of the HTML file
+
+        :type rows: list
+
+        :type counts: dict
+
+        :type test_list: str
+
+        :type output: str
+    '''
+    root = os.path.abspath(os.path.dirname(__file__))
+    with open(root + '/templates/enquire.html', 'r') as template_file:
+        template = Template(template_file.read())
+    now = datetime.datetime.now()
+    with open(output, 'w') as outfile:
+        outfile.write(
+            template.render(
+                test_list=os.path.abspath(test_list),
+                date=now.strftime("%d-%m-%Y"),
+                time=now.strftime("%H:%M"),
+                version=__version__,
+                counts=counts,
+                rows=[row for row in rows if row['state'] != 'tohost']))
+
+
+def enquire(test_list, hart_id, output, output_format='json', html=None,
+            process_count=None):
+    '''
+        Function to check the status of the tests of a test list and save it
+        as JSON or CSV, optionally with an HTML page.
+
+        :param test_list: Test list to check
+
+        :param hart_id: Hart whose dump is checked when there is no dut.dump
+
+        :param output: Path of the JSON or CSV file
+
+        :param output_format: json or csv
+
+        :param html: Path of the HTML page, None to skip it
+
+        :param process_count: Number of threads checking the tests
+
+        :type test_list: str
+
+        :type hart_id: str
+
+        :type output: str
+
+        :type output_format: str
+
+        :type html: str
+
+        :type process_count: int
+
+        :return: Number of tests in each state
+
+        :rtype: dict
+    '''
+    test_dict = utils.load_yaml(test_list)
+    rows = status_rows(test_dict,
+                       check_tests(test_dict, hart_id, process_count))
+    counts = dict.fromkeys(states[:5], 0)
+    for row in rows:
+        counts[row['state']] = counts[row['state']] + 1
+    for state, count in counts.items():
+        logger.info('{0:<15} : {1}'.format(state, count))
+    write_status(rows, output, output_format)
+    logger.info('Status saved at {0}'.format(output))
+    if html:
+        write_html(rows, counts, test_list, html)
+        logger.info('Report saved at {0}'.format(html))
+    return counts
+
+
+class Watcher():
+    """
+    Tracks the status of the tests of a running regression. Each poll only
+    looks at the tests which have not reached tohost, and a test is checked
+    again only when a stat of its work_dir or dumps shows a change, so a
+    poll of a large regression costs a few stats per unfinished test.
+    """
+
+    def __init__(self, test_dict, hart_id, result_file=None,
+                 process_count=None):
+        """ Constructor.
+
+        :param test_dict: Test list of the regression
+
+        :param hart_id: Hart whose dump is checked when there is no dut.dump
+
+        :param result_file: result_list.yaml written by the compare stage
+
+        :param process_count: Number of threads checking the tests
+
+        :type test_dict: dict
+
+        :type hart_id: str
+
+        :type result_file: str
+
+        :type process_count: int
+        """
+        self.test_dict = test_dict
+        self.hart_id = hart_id
+        self.result_file = result_file
+        self.process_count = process_count
+        self.states = {test: 'not compiled' for test in test_dict}
+        self.stats = {}
+        self.result_stat = None
+        self.finished = False
+        self.start = time.time()
+        self.start_done = None
+
+    def _stat(self, test):
+        # The work_dir changes when files are created in it and the dumps
+        # while they are written
+        work_dir = self.test_dict[test]['work_dir']
+        paths = [work_dir]
+        if self.states[test] not in ('not compiled', 'compiled'):
+            for dump in ('/dut.dump', '/rtl_' + str(self.hart_id) + '.dump',
+                         '/ref.dump'):
+                paths.append(
+                    utils.find_dump(work_dir + dump) or work_dir + dump)
+        stats = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stats.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def _check(self, test):
+        stats = self._stat(test)
+        if stats == self.stats.get(test):
+            return test, None
+        self.stats[test] = stats
+        try:
+            return test, test_status(test, self.test_dict[test],
+                                     self.hart_id)[0]
+        except (OSError, ValueError, struct.error):
+            # Files which are being written are checked again later
+            return test, None
+
+    def _load_results(self):
+        try:
+            stat = os.stat(self.result_file)
+        except (OSError, TypeError):
+            return
+        if (stat.st_size, stat.st_mtime_ns) == self.result_stat:
+            return
+        self.result_stat = (stat.st_size, stat.st_mtime_ns)
+        # A result list older than the watch is of an earlier run. File times
+        # come from a coarser clock, hence the second of slack.
+        if stat.st_mtime < self.start - 1:
+            return
+        results = utils.load_yaml(self.result_file)
+        for test, attr in results.items():
+            result = str(attr.get('result', ''))
+            if test not in self.states or not result:
+                continue
+            if 'Unavailable' in result:
+                self.states[test] = 'unavailable'
+            else:
+                self.states[test] = 'compared' if result == 'Passed' else 'failed'
+        # The compare stage writes the result list once, at the end of the run
+        self.finished = True
+
+    def poll(self):
+        """
+        Update the states of the tests.
+
+        :return: Number of tests in each state
+
+        :rtype: dict
+        """
+        self._load_results()
+        active = [
+            test for test, state in self.states.items()
+            if state not in ('tohost', 'compared', 'failed', 'unavailable')
+        ]
+        with ThreadPoolExecutor(max_workers=self.process_count) as executor:
+            for test, state in executor.map(self._check, active):
+                if state is not None:
+                    self.states[test] = state
+        counts = dict.fromkeys(states, 0)
+        for state in self.states.values():
+            counts[state] = counts[state] + 1
+        if self.start_done is None:
+            self.start_done = self.done(counts)
+        return counts
+
+    def done(self, counts):
+        """
+        Number of tests which finished simulating.
+
+        :param counts: Number of tests in each state
+
+        :type counts: dict
+
+        :rtype: int
+        """
+        return counts['tohost'] + counts['compared'] + counts['failed'] + \
+            counts['unavailable']
+
+    def summary(self, counts):
+        """
+        Line summarising the progress of the regression, with the number of
+        tests finished per minute since the watch started and the time left
+        at that rate.
+
+        :param counts: Number of tests in each state
+
+        :type counts: dict
+
+        :rtype: str
+        """
+        elapsed = max(time.time() - self.start, 1e-6)
+        finished = self.done(counts) - self.start_done
+        rate = finished * 60 / elapsed
+        remaining = len(self.states) - self.done(counts)
+        if remaining == 0:
+            eta = 'done'
+        elif finished:
+            eta = time.strftime('%H:%M:%S',
+                                time.gmtime(remaining * elapsed / finished))
+        else:
+            eta = 'unknown'
+        parts = [
+            '{0}: {1}'.format(state, counts[state]) for state in states
+            if counts[state] or
+            state not in ('ref error', 'failed', 'unavailable')
+        ]
+        return '{0} | {1:.1f} tests/min | ETA {2}'.format(
+            ', '.join(parts), rate, eta)
+
+
+def watch(test_list, hart_id, interval=5, process_count=None):
+    '''
+        Function to print the progress of a running regression until all its
+        tests finished simulating and were compared, the result list of the
+        run was written, or until interrupted. The results of the compares
+        are only known once the compare stage writes the result list at the
+        end of the run, so the tests show as compared or failed only then; a
+        result list older than the watch belongs to an earlier run and is
+        ignored.
+
+        :param test_list: Test list of the regression
+
+        :param hart_id: Hart whose dump is checked when there is no dut.dump
+
+        :param interval: Seconds between polls
+
+        :param process_count: Number of threads checking the tests
+
+        :type test_list: str
+
+        :type hart_id: str
+
+        :type interval: float
+
+        :type process_count: int
+    '''
+    test_dict = utils.load_yaml(test_list)
+    result_file = os.path.join(os.path.dirname(os.path.abspath(test_list)),
+                               'result_list.yaml')
+    watcher = Watcher(test_dict, hart_id, result_file, process_count)
+    logger.info('Watching {0} tests, press Ctrl+C to stop'.format(
+        len(test_dict)))
+    # Overwrite the line on terminals, print a line per poll otherwise
+    end = '\r' if sys.stdout.isatty() else '\n'
+    try:
+        while True:
+            counts = watcher.poll()
+            click.echo('\x1b[2K' * sys.stdout.isatty() +
+                       watcher.summary(counts) + end,
+                       nl=False)
+            if watcher.finished or counts['compared'] + counts['failed'] + \
+                    counts['unavailable'] == len(test_dict):
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    click.echo('')
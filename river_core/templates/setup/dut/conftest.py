@@ -12,6 +12,8 @@ def pytest_addoption(parser):
     parser.addoption("--make_file", action="store")
     parser.addoption("--work_dir", action="store")
     parser.addoption("--key_list", action="store")
+    parser.addoption("--test_list", action="store")
+    parser.addoption("--ref_dumps_since", action="store", default='')
 
 
 @pytest.mark.optionalhook
@@ -57,7 +57,14 @@ def test_input(request):
     logger.debug('Generating commands from test_input fixture')
     program = request.param
     stage = program.split()[-1]
-    (ret, out, err) = sys_command(program)
+    monitor = None
+    since = request.config.getoption("ref_dumps_since")
+    if since:
+        # Stop the simulation at the first divergence from the reference dump
+        attr = load_yaml(request.config.getoption("test_list"))[stage]
+        monitor = dump_monitor(attr, float(since),
+                               os.path.join(attr['work_dir'], 'rtl.dump'))
+    (ret, out, err) = sys_command(program, monitor=monitor)
     return ret, err, stage
 
 
@@ -65,6 +65,11 @@ class sample_plugin(object):
         os.makedirs(self.sim_path, exist_ok=True)
 
         self.test_list = load_yaml(test_list)
+        self.test_list_file = test_list
+
+        # Set by river_core compile when the reference plugins ran first, so
+        # that the tests can stop at their first divergence
+        self.ref_dumps_since = ini_config.get('ref_dumps_since', '')
 
         self.json_dir = self.work_dir + '/.json/'
 
@@ -169,6 +174,8 @@ class sample_plugin(object):
             '--work_dir={0}'.format(self.work_dir),
             '--make_file={0}'.format(self.make_file),
             '--key_list={0}'.format(self.test_names),
+            '--test_list={0}'.format(self.test_list_file),
+            '--ref_dumps_since={0}'.format(self.ref_dumps_since),
             '--log-cli-level=DEBUG',
             '-o log_cli=true',
         ])
@@ -4,59 +4,1209 @@ import sys
 import os
 import subprocess
 import shlex
+import shutil
+import hashlib
+import io
+import gzip
+import lzma
+import json
+import time
+import struct
+import itertools
 from river_core.log import logger
 import distutils.util
 import ruamel
 import signal
 from ruamel.yaml import YAML
 from threading import Timer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pathlib
 import shlex
 import riscv_config.isa_validator as isa_val
 import re
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 dump_regex = re.compile(r'.*core\s*(?P<coreid>\d):\s*(?P<priv>\d)\s*(?P<pc>.*?)\s+\((?P<instr>.*?)\)(?P<change>.*?)$')
+# coreid of a record, for splitting dumps by hart
+hart_regex = re.compile(rb'core\s*(\d+):')
 
 yaml = YAML(typ="safe")
 yaml.default_flow_style = False
 yaml.allow_unicode = True
 
+#: Symbols recorded in the ELF index of a work_dir
+elf_index_symbols = [
+    'tohost', 'fromhost', 'begin_signature', 'end_signature', '_start'
+]
+#: Name of the ELF index in a work_dir
+elf_index_file = '.elf_index.json'
+
+# ioctl to clone a file on filesystems with copy-on-write (btrfs, xfs)
+FICLONE = 0x40049409
+# Whether reflinks work between a pair of devices, found on the first attempt
+_reflink_devices = {}
+
+#: Size of the blocks in which dumps and signatures are scanned
+read_size = 1 << 20
+# Line counts of files, with the size and mtime they were counted at
+_line_counts = {}
+
+#: Suffix of the digest sidecar of a dump
+digest_suffix = '.digest'
+# Whitespace dropped from the records before digesting, newlines are kept
+digest_whitespace = b' \t\r\x0b\x0c'
+
+#: Compression of dumps, by the suffix of their names
+dump_suffixes = {'.gz': 'gzip', '.xz': 'xz', '.zst': 'zstd'}
+# First bytes of the compressed files, for dumps without a suffix
+dump_magics = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'zstd': b'\x28\xb5\x2f\xfd'
+}
+#: Suffix of the frame index written along with a compressed dump
+frames_suffix = '.frames'
+#: Suffix of the record index written for the triage of a dump
+index_suffix = '.index'
+# First hunk of a diff, with the lines it starts at in each file
+hunk_regex = re.compile(r'^(\d+)(?:,\d+)?[acd](\d+)', re.M)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        logger.error('zstandard is required for .zst dumps: pip install zstandard')
+        raise SystemExit(1)
+    return zstandard
+
+
+def dump_compression(path):
+    '''
+        Function to find the compression of a dump from the suffix of its
+        name, or from its first bytes.
+
+        :param path: Path of the dump
+
+        :type path: str
+
+        :return: 'gzip', 'xz' or 'zstd', None for a plain dump
+
+        :rtype: str
+    '''
+    for suffix, compression in dump_suffixes.items():
+        if path.endswith(suffix):
+            return compression
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for compression, prefix in dump_magics.items():
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+def find_dump(path):
+    '''
+        Function to find a dump which may have been saved compressed.
+
+        :param path: Path of the plain dump, like work_dir/dut.dump
+
+        :type path: str
+
+        :return: The path, or the path of its compressed version, None when neither exists
+
+        :rtype: str
+    '''
+    if os.path.exists(path):
+        return path
+    for suffix in dump_suffixes:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return None
+
+
+def _decompress(raw, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(raw, mode='rb')
+    reader = _zstandard().ZstdDecompressor().stream_reader(
+        raw, read_across_frames=True, closefd=True)
+    return io.BufferedReader(reader, read_size)
+
+
+def open_dump(path, mode='rb'):
+    '''
+        Function to open a dump for reading, decompressing it as a stream
+        when it is compressed.
+
+        :param path: Path of the dump
+
+        :param mode: 'rb' for bytes or 'r' for text
+
+        :type path: str
+
+        :type mode: str
+
+        :return: File object of the uncompressed dump
+
+        :rtype: io.IOBase
+    '''
+    compression = dump_compression(path)
+    if compression is None:
+        stream = open(path, 'rb')
+    else:
+        stream = _decompress(open(path, 'rb'), compression)
+    if mode == 'r':
+        return io.TextIOWrapper(stream, errors='replace')
+    return stream
+
+
+def dump_frames(path):
+    '''
+        Function to read the frame index of a compressed dump written by
+        :py:class:`DumpWriter`.
+
+        :param path: Path of the compressed dump
+
+        :type path: str
+
+        :return: Compressed and uncompressed offsets of the frames, None when
+            the dump has no index matching its size and mtime
+
+        :rtype: list
+    '''
+    try:
+        with open(path + frames_suffix) as f:
+            index = json.load(f)
+        stat = os.stat(path)
+        if index['size'] == stat.st_size and \
+                index['mtime_ns'] == stat.st_mtime_ns:
+            return index['frames']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def read_dump_tail(path):
+    '''
+        Function to read the end of a compressed dump. With a frame index
+        only the last frame is decompressed, else the whole dump is.
+
+        :param path: Path of the compressed dump
+
+        :type path: str
+
+        :return: Uncompressed data from the start of the last frame to the end
+
+        :rtype: bytes
+    '''
+    frames = dump_frames(path)
+    raw = open(path, 'rb')
+    if frames:
+        raw.seek(frames[-1][0])
+    with _decompress(raw, dump_compression(path)) as stream:
+        if frames:
+            return stream.read()
+        data = b''
+        for block in iter(lambda: stream.read(read_size), b''):
+            data = data[-read_size:] + block
+        return data
+
+
+class DumpWriter():
+    '''
+        Writer of a dump for plugins, compressed by the suffix of its name
+        (.gz, .xz or .zst). The data is compressed in independent frames
+        which start at lines, and the offsets of the frames are saved in an
+        index so that the end of the dump is read without decompressing all
+        of it. The digest sidecar of the dump is saved as well.
+
+        :param path: Path of the dump
+
+        :param frame_size: Uncompressed bytes in each frame
+
+        :type path: str
+
+        :type frame_size: int
+    '''
+
+    def __init__(self, path, frame_size=4 << 20):
+        self.path = path
+        self.frame_size = frame_size
+        self.compression = None
+        for suffix, compression in dump_suffixes.items():
+            if path.endswith(suffix):
+                self.compression = compression
+        if self.compression == 'zstd':
+            self._zstd = _zstandard().ZstdCompressor()
+        self._file = open(path, 'wb')
+        self._buffer = bytearray()
+        self._offset = 0
+        self.frames = []
+        self.digest = DumpDigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _compress(self, data):
+        if self.compression == 'gzip':
+            return gzip.compress(data)
+        if self.compression == 'xz':
+            return lzma.compress(data)
+        return self._zstd.compress(data)
+
+    def _flush(self, end):
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        if self.compression is None:
+            self._file.write(data)
+            return
+        self.frames.append([self._file.tell(), self._offset])
+        self._file.write(self._compress(data))
+        self._offset += len(data)
+
+    def write(self, data):
+        '''
+            Function to write to the dump.
+
+            :param data: Records to write
+
+            :type data: bytes or str
+        '''
+        if isinstance(data, str):
+            data = data.encode()
+        self.digest.update(data)
+        self._buffer += data
+        if len(self._buffer) >= self.frame_size:
+            end = self._buffer.rfind(b'\n') + 1
+            if end:
+                self._flush(end)
+
+    def close(self):
+        '''
+            Function to finish the dump and save its index and digest.
+        '''
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._flush(len(self._buffer))
+        self._file.close()
+        if self.compression is not None:
+            stat = os.stat(self.path)
+            with open(self.path + frames_suffix, 'w') as f:
+                json.dump(
+                    {
+                        'size': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns,
+                        'frames': self.frames
+                    }, f)
+        self.digest.save(self.path)
+
+
 def self_check(file1):
-  '''
-  Function to check if all values in the signature are 0s to indicate a pass,
-  else the test has failed.
-  '''
-  result = 'Passed'
-  rout = ''
-  with open(file1,'r') as f:
-    for lineno, line in enumerate(f):
-      line_val = f'0x{line}'
-      if int(line_val,0) != 0:
-        result = 'Failed'
-        rout = f'\nLine:{lineno} has a non-zero value indicating a fail'
-  return result, rout
+    '''
+    Function to check if all values in the signature are 0s to indicate a pass,
+    else the test has failed. The signature is scanned in large blocks with
+    the zeros and whitespace stripped, and the scan stops at the first
+    non-zero word.
+    '''
+    result = 'Passed'
+    rout = ''
+    lineno = 0
+    with open_dump(file1) as f:
+        for block in iter(lambda: f.read(read_size), b''):
+            if not block.translate(None, b'0 \t\r\n'):
+                lineno += block.count(b'\n')
+                continue
+            for line in block.split(b'\n'):
+                if line.translate(None, b'0 \t\r'):
+                    result = 'Failed'
+                    rout = f'\nLine:{lineno} has a non-zero value indicating a fail'
+                    return result, rout
+                lineno += 1
+            # the last piece of the block is not a full line
+            lineno -= 1
+    return result, rout
+
+def count_lines(file):
+    '''
+    Function to count the lines of a file in large blocks, using constant
+    memory. A last line without a newline is counted. Compressed dumps are
+    counted uncompressed, from their digest sidecar when they have one.
+    Counts are cached until the size or mtime of the file changes.
+    '''
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _line_counts.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = dump_digest(path, compute=False)
+    if digest is not None:
+        _line_counts[path] = (key, digest['lines'])
+        return digest['lines']
+    with open_dump(path) as fd:
+        count = 0
+        last = b'\n'
+        for block in iter(lambda: fd.read(read_size), b''):
+            count += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        count += 1
+    _line_counts[path] = (key, count)
+    return count
+
+class DumpDigest():
+    '''
+        Streaming digest of a dump over its records with case and whitespace
+        dropped, so that dumps which ``diff -iw`` finds equal have equal
+        digests. Plugins can update it with the data they write to a dump and
+        save it as the digest sidecar of the dump once it is closed.
+    '''
+
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=16)
+        self.lines = 0
+        self._last = b'\n'
+
+    def update(self, data):
+        '''
+            Function to add data written to the dump.
+
+            :param data: Next piece of the dump
+
+            :type data: bytes
+        '''
+        if not data:
+            return
+        self._hash.update(data.lower().translate(None, digest_whitespace))
+        self.lines += data.count(b'\n')
+        self._last = data[-1:]
+
+    def result(self):
+        '''
+            Function to get the digest and line count of the data so far.
+
+            :return: Digest and number of lines, with a last line without a newline counted
+
+            :rtype: dict
+        '''
+        lines = self.lines + (self._last != b'\n')
+        return {'digest': self._hash.hexdigest(), 'lines': lines}
+
+    def save(self, dump):
+        '''
+            Function to write the digest sidecar of a finished dump.
+
+            :param dump: Path of the dump the data was written to
+
+            :type dump: str
+        '''
+        stat = os.stat(dump)
+        digest = self.result()
+        digest.update({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        with open(dump + digest_suffix, 'w') as f:
+            json.dump(digest, f)
+
+
+def dump_digest(dump, compute=True):
+    '''
+        Function to get the digest of a dump from its sidecar, when the
+        sidecar matches the size and mtime of the dump. Without a sidecar the
+        dump is read in blocks and a new sidecar is saved.
+
+        :param dump: Path of the dump
+
+        :param compute: Whether to digest a dump which has no sidecar
+
+        :type dump: str
+
+        :type compute: bool
+
+        :return: Digest and number of lines of the dump, None when it has no
+            sidecar and compute is False
+
+        :rtype: dict
+    '''
+    stat = os.stat(dump)
+    try:
+        with open(dump + digest_suffix) as f:
+            digest = json.load(f)
+        if digest['size'] == stat.st_size and \
+                digest['mtime_ns'] == stat.st_mtime_ns:
+            return digest
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if not compute:
+        return None
+    digest = DumpDigest()
+    with open_dump(dump) as f:
+        for block in iter(lambda: f.read(read_size), b''):
+            digest.update(block)
+    try:
+        digest.save(dump)
+    except OSError:
+        # A read-only work_dir only loses the caching
+        pass
+    return digest.result()
 
 def get_file_size(file):
     '''
     Function to give the number of lines
     '''
-    with open(f'{file}','r') as fd:
-      rcount = len(fd.readlines())
-    return rcount
+    return count_lines(file)
 
-def compare_dumps(file1, file2):
+def compare_records(record1, record2):
+    '''
+        Function to check whether two records of dumps are equivalent. Records
+        which differ only in case and whitespace are equivalent like in
+        ``diff -iw``, others are equivalent when their coreid, priv, pc and
+        instruction encoding match and they make the same architectural change.
+
+        :param record1: Line of the first dump
+        :param record2: Line of the second dump
+        :type record1: str
+        :type record2: str
+        :return: None when the records are equivalent, else the kind of the
+            mismatch ('BM' for a different commit, 'SM' for a different
+            change, 'record' for a line which is not a commit) and the PCs of
+            the records
+        :rtype: tuple
+    '''
+    if record1 == record2 or \
+            ''.join(record1.lower().split()) == ''.join(record2.lower().split()):
+        return None
+    # get regex strings
+    try:
+        file1_dat = dump_regex.findall(record1)[0]
+        file2_dat = dump_regex.findall(record2)[0]
+    except IndexError:
+        return 'record', None, None
+
+    # ensure commit message exists in same line number else fail
+    # if any of coreid, priv, pc or instr encoding fails, the diff has failed
+    if file1_dat[0:3] != file2_dat[0:3]:
+        return 'BM', file1_dat[2], file2_dat[2]
+
+    # some cleanup
+    change1 = file1_dat[-1].split()
+
+    # if odd number, it's a store
+    if len(change1) % 2:
+        change1.remove('mem')
+
+    # check if the architectural change is the same
+    file1dat_iter = iter(change1)
+    file2dat_iter = iter(file2_dat[-1].split())
+
+    file1_change = dict(zip(file1dat_iter, file1dat_iter))
+    file2_change = dict(zip(file2dat_iter, file2dat_iter))
+
+    if file1_change != file2_change:
+        return 'SM', file1_dat[2], file2_dat[2]
+    return None
+
+def skip_records(records, head=0, tail=0):
+    '''
+        Generator dropping records from the start and end of a stream,
+        holding back only the last tail records.
+
+        :param records: The records, like the lines of an open dump
+
+        :param head: Number of records dropped at the start
+
+        :param tail: Number of records dropped at the end
+
+        :type records: iterable
+
+        :type head: int
+
+        :type tail: int
+    '''
+    records = itertools.islice(records, head, None)
+    if not tail:
+        yield from records
+        return
+    held = deque()
+    for record in records:
+        held.append(record)
+        if len(held) > tail:
+            yield held.popleft()
+
+
+def test_skip(attr, raw=False):
+    '''
+        Function to find the records the compare of a test skips, from the
+        compare_skip and ignore_lines of its test list entry. The end of the
+        DuT dump defaults to ignore_lines.
+
+        :param attr: The test list entry of the test
+
+        :param raw: The dumps are compared as the simulators write them, like
+            in lockstep, so records are skipped even without compare_skip
+
+        :type attr: dict
+
+        :type raw: bool
+
+        :return: Records skipped, with the keys dut_head, dut_tail, ref_head
+            and ref_tail, None to compare the dumps whole
+
+        :rtype: dict
+    '''
+    skip = attr.get('compare_skip')
+    if skip is None and not raw:
+        return None
+    return dict({'dut_tail': attr.get('ignore_lines', 0)}, **(skip or {}))
+
+
+def stream_compare_dumps(file1, file2, skip):
+    '''
+        Function to compare two dumps record by record while reading them,
+        skipping records at the head and tail of each. Compare stops at the
+        first mismatch, and dumps with a different number of records fail.
+        The dumps are indexed as they are read, and the index of failing
+        dumps is saved for their triage, see :py:class:`DumpIndex`.
+
+        :param file1: The path to the DuT dump
+        :param file2: The path to the reference dump
+        :param skip: Records skipped, with the keys dut_head, dut_tail,
+            ref_head and ref_tail
+        :type file1: str
+        :type file2: str
+        :type skip: dict
+        :return: Result, log of the mismatch and number of records of the
+            DuT dump, without the skipped ones
+        :rtype: tuple
+    '''
+    status = 'Passed'
+    rout = ''
+    count = 0
+    index1 = DumpIndex(file1)
+    index2 = DumpIndex(file2)
+    with open_dump(file1) as dump1, open_dump(file2) as dump2:
+        records1 = skip_records(index1.lines(dump1), skip.get('dut_head', 0),
+                                skip.get('dut_tail', 0))
+        records2 = skip_records(index2.lines(dump2), skip.get('ref_head', 0),
+                                skip.get('ref_tail', 0))
+        for record1, record2 in itertools.zip_longest(records1, records2):
+            if record1 is None or record2 is None:
+                ended = file1 if record1 is None else file2
+                rout = f'{ended} ended after {count} records'
+                status = 'Failed'
+                break
+            mismatch = compare_records(record1, record2)
+            if mismatch is not None:
+                kind, file1_pc, file2_pc = mismatch
+                rout = f'Record {count + 1}\n< {record1.rstrip()}\n> {record2.rstrip()}'
+                rout += '\nMismatch infos:'
+                if kind == 'BM':
+                    rout = rout + f'\nBM: {file1} at PC: {file1_pc} and {file2} at PC: {file2_pc}'
+                elif kind == 'SM':
+                    rout = rout + f'\nSM: at PC: {file1_pc}'
+                status = 'Failed'
+                break
+            count = count + 1
+        if status == 'Failed':
+            # The rest of the dumps is indexed in the same pass, for the
+            # window of the mismatch and later triage
+            index1.read(dump1)
+            index2.read(dump2)
+    if status == 'Failed':
+        index1.save()
+        index2.save()
+        rout += mismatch_window(file1, file2,
+                                count + 1 + skip.get('dut_head', 0),
+                                count + 1 + skip.get('ref_head', 0))
+        # The records of the DuT, as for a test which passes
+        count = max(
+            index1.index['lines'] - skip.get('dut_head', 0) -
+            skip.get('dut_tail', 0), 0)
+    return status, rout, count
+
+
+def _find_pc(data, pc, record, occurrences):
+    # Records of data which commit at pc. data holds full lines, the first of
+    # which has the number record.
+    needle = pc.lower().encode()
+    data = data.lower()
+    pos = 0
+    hit = data.find(needle)
+    while hit != -1:
+        record += data.count(b'\n', pos, hit)
+        pos = hit
+        line_start = data.rfind(b'\n', 0, hit) + 1
+        line_end = data.find(b'\n', hit)
+        if line_end == -1:
+            line_end = len(data)
+        found = dump_regex.findall(data[line_start:line_end].decode(
+            errors='replace'))
+        if found and found[0][2].lower() == pc.lower():
+            occurrences.append(record)
+        hit = data.find(needle, line_end)
+    return occurrences
+
+
+class DumpIndex():
+    '''
+        Triage index of a dump, built while the dump is read. The index holds
+        the number of the first record of each block with its offset in the
+        uncompressed dump, and the records which commit at each of the given
+        PCs. The compare of the dumps indexes them as it streams them, so
+        that the triage of a mismatch does not read them again.
+
+        :param dump: Path of the dump
+
+        :param pcs: PCs whose records are indexed
+
+        :type dump: str
+
+        :type pcs: list
+    '''
+
+    def __init__(self, dump, pcs=()):
+        stat = os.stat(dump)
+        self.dump = dump
+        self.index = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'lines': 0,
+            'records': [],
+            'pcs': {pc: [] for pc in pcs}
+        }
+        self._offset = 0
+        # Offset from which the next record is indexed
+        self._next = 0
+
+    def lines(self, f):
+        '''
+            Generator of the lines of a dump, indexing them as they are read.
+
+            :param f: The dump, opened with :py:func:`open_dump` in bytes
+
+            :type f: io.IOBase
+
+            :return: The lines, decoded
+
+            :rtype: generator
+        '''
+        index = self.index
+        for line in f:
+            if self._offset >= self._next:
+                index['records'].append([index['lines'], self._offset])
+                self._next = self._offset + read_size
+            for pc, occurrences in index['pcs'].items():
+                _find_pc(line, pc, index['lines'], occurrences)
+            index['lines'] += 1
+            self._offset += len(line)
+            yield line.decode(errors='replace')
+
+    def read(self, f):
+        '''
+            Function to index the rest of a dump in blocks, from where
+            :py:meth:`lines` stopped.
+
+            :param f: The dump, opened with :py:func:`open_dump` in bytes
+
+            :type f: io.IOBase
+        '''
+        index = self.index
+        carry = b''
+        for block in iter(lambda: f.read(read_size), b''):
+            data = carry + block
+            end = data.rfind(b'\n') + 1
+            carry = data[end:]
+            data = data[:end]
+            if data:
+                index['records'].append([index['lines'], self._offset])
+                for pc, occurrences in index['pcs'].items():
+                    _find_pc(data, pc, index['lines'], occurrences)
+                index['lines'] += data.count(b'\n')
+                self._offset += len(data)
+        if carry:
+            index['records'].append([index['lines'], self._offset])
+            for pc, occurrences in index['pcs'].items():
+                _find_pc(carry, pc, index['lines'], occurrences)
+            index['lines'] += 1
+            self._offset += len(carry)
+
+    def save(self):
+        '''
+            Function to write the index of a fully read dump as its .index
+            sidecar.
+
+            :return: The index
+
+            :rtype: dict
+        '''
+        try:
+            with open(self.dump + index_suffix, 'w') as f:
+                json.dump(self.index, f)
+        except OSError:
+            pass
+        return self.index
+
+
+def build_dump_index(dump, pcs=()):
+    '''
+        Function to index a dump for triage in one pass and save the index
+        as its .index sidecar, see :py:class:`DumpIndex`.
+
+        :param dump: Path of the dump
+
+        :param pcs: PCs whose records are indexed
+
+        :type dump: str
+
+        :type pcs: list
+
+        :return: The index
+
+        :rtype: dict
+    '''
+    indexer = DumpIndex(dump, pcs)
+    with open_dump(dump) as f:
+        indexer.read(f)
+    return indexer.save()
+
+
+def _saved_index(dump):
+    # The .index sidecar of a dump, None when missing or stale
+    stat = os.stat(dump)
+    try:
+        with open(dump + index_suffix) as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and \
+                index['mtime_ns'] == stat.st_mtime_ns:
+            return index
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def dump_index(dump, pcs=()):
+    '''
+        Function to get the triage index of a dump from its sidecar, building
+        it when the sidecar is missing, stale or lacks one of the PCs.
+
+        :param dump: Path of the dump
+
+        :param pcs: PCs whose records are needed
+
+        :type dump: str
+
+        :type pcs: list
+
+        :return: The index
+
+        :rtype: dict
+    '''
+    index = _saved_index(dump)
+    if index is not None:
+        if all(pc in index['pcs'] for pc in pcs):
+            return index
+        pcs = sorted(set(pcs) | set(index['pcs']))
+    return build_dump_index(dump, pcs)
+
+
+def _open_dump_at(dump, offset):
+    # Open a dump at an uncompressed offset. A compressed dump is decompressed
+    # from the frame before the offset when it has a frame index, else from
+    # its start.
+    compression = dump_compression(dump)
+    frames = dump_frames(dump) if compression else None
+    if not frames:
+        f = open_dump(dump)
+        f.seek(offset)
+        return f
+    start = frames[0]
+    for frame in frames:
+        if frame[1] > offset:
+            break
+        start = frame
+    raw = open(dump, 'rb')
+    raw.seek(start[0])
+    f = _decompress(raw, compression)
+    skip = offset - start[1]
+    while skip > 0:
+        data = f.read(min(skip, read_size))
+        if not data:
+            break
+        skip -= len(data)
+    return f
+
+
+def read_records(dump, start, count, index=None):
+    '''
+        Function to read records of a dump, starting from the indexed record
+        before them. Compressed dumps written by :py:class:`DumpWriter` are
+        decompressed from the frame of that record.
+
+        :param dump: Path of the dump
+
+        :param start: Number of the first record, from 0
+
+        :param count: Number of records
+
+        :param index: Triage index of the dump
+
+        :type dump: str
+
+        :type start: int
+
+        :type count: int
+
+        :type index: dict
+
+        :return: Number and text of each record
+
+        :rtype: list
+    '''
+    record, offset = 0, 0
+    if index is not None:
+        for entry in index['records']:
+            if entry[0] > start:
+                break
+            record, offset = entry
+    found = []
+    with _open_dump_at(dump, offset) as f:
+        for line in f:
+            if record >= start:
+                found.append(
+                    (record, line.decode(errors='replace').rstrip('\r\n')))
+                if len(found) == count:
+                    break
+            record += 1
+    return found
+
+
+def dump_window(dump, record=None, pc=None, occurrence=1, window=8,
+                build=True):
+    '''
+        Function to show the records of a dump around a record, or around an
+        occurrence of a PC, using the triage index of the dump.
+
+        :param dump: Path of the dump
+
+        :param record: Number of the record, from 1
+
+        :param pc: PC whose occurrence is shown when no record is given
+
+        :param occurrence: Occurrence of the PC, from 1
+
+        :param window: Number of records shown before and after
+
+        :param build: Build the index when the dump has none. Otherwise the
+            dump is read from its start up to the window, and a PC needs
+            the index.
+
+        :type dump: str
+
+        :type record: int
+
+        :type pc: str
+
+        :type occurrence: int
+
+        :type window: int
+
+        :type build: bool
+
+        :return: The records, with the one in focus marked by >
+
+        :rtype: str
+    '''
+    if build or record is None:
+        index = dump_index(dump, [pc] if pc else [])
+    else:
+        index = _saved_index(dump)
+    if record is None:
+        occurrences = index['pcs'][pc]
+        if len(occurrences) < occurrence:
+            return '{0}: {1} occurrences of PC {2}'.format(
+                dump, len(occurrences), pc)
+        record = occurrences[occurrence - 1] + 1
+    start = max(record - 1 - window, 0)
+    text = '{0}: record {1}'.format(dump, record)
+    if index is not None:
+        text += ' of {0}'.format(index['lines'])
+    for number, line in read_records(dump, start, 2 * window + 1, index):
+        mark = '>' if number == record - 1 else ' '
+        text += '\n{0} {1:>10} {2}'.format(mark, number + 1, line)
+    return text
+
+
+def mismatch_window(file1, file2, record1, record2, window=8):
+    '''
+        Function to show the records of both dumps around a mismatch. The
+        index saved by :py:func:`stream_compare_dumps` is used when there is
+        one, else the dumps are read only up to the window; river_core triage
+        indexes them when it is first run.
+
+        :param file1: The path to the DuT dump
+        :param file2: The path to the reference dump
+        :param record1: Number of the mismatching record of the DuT dump, from 1
+        :param record2: Number of the mismatching record of the reference dump, from 1
+        :param window: Number of records shown before and after
+        :type file1: str
+        :type file2: str
+        :type record1: int
+        :type record2: int
+        :type window: int
+        :return: The records of both dumps
+        :rtype: str
+    '''
+    return '\nDivergence window:\n{0}\n{1}'.format(
+        dump_window(file1, record1, window=window, build=False),
+        dump_window(file2, record2, window=window, build=False))
+
+
+def _digests_match(file1, file2):
+    # Most dumps match, which the digests saved along with them show without
+    # a diff. Digesting is slower than diff, so dumps without one are diffed.
+    if not os.path.exists(file2):
+        return None
+    digest1 = dump_digest(file1, compute=False)
+    digest2 = dump_digest(file2, compute=False)
+    if digest1 and digest2 and digest1['digest'] == digest2['digest']:
+        return digest1['lines']
+    return None
+
+
+def dump_harts(dump):
+    '''
+        Function to find the harts in a dump from the coreids of the records
+        in its first block. Harts which start later are not found, see
+        :py:func:`split_dump`.
+
+        :param dump: Path of the dump
+
+        :type dump: str
+
+        :return: The coreids found
+
+        :rtype: list
+    '''
+    with open_dump(dump) as f:
+        block = f.read(read_size)
+    return sorted(set(int(hart) for hart in hart_regex.findall(block)))
+
+
+def multi_hart(dump):
+    '''
+        Function to find whether a dump has records of more than one hart.
+        The dump is read in blocks until the first record of a second hart,
+        so a dump of one hart is read once and not written.
+
+        :param dump: Path of the dump
+
+        :type dump: str
+
+        :rtype: bool
+    '''
+    harts = set()
+    carry = b''
+    with open_dump(dump) as f:
+        for block in iter(lambda: f.read(read_size), b''):
+            data = carry + block
+            end = data.rfind(b'\n') + 1
+            carry = data[end:]
+            harts.update(hart_regex.findall(data, 0, end))
+            if len(harts) > 1:
+                return True
+    harts.update(hart_regex.findall(carry))
+    return len(harts) > 1
+
+
+def split_dump(dump, out_dir, name, head=0, tail=0):
+    '''
+        Function to split a dump by the coreid of its records in one pass,
+        finding its harts as they appear. Lines which are not records go with
+        the record before them, or with the first record at the start. The
+        dumps of the harts are compressed like the dump, see
+        :py:class:`DumpWriter`.
+
+        :param dump: Path of the dump
+
+        :param out_dir: Directory of the dumps of the harts
+
+        :param name: Prefix of the dumps of the harts, written as
+            <name>_<hart>.dump with the suffix of the compression of the dump
+
+        :param head: Records skipped at the start of the dump
+
+        :param tail: Records skipped at the end of the dump
+
+        :type dump: str
+
+        :type out_dir: str
+
+        :type name: str
+
+        :type head: int
+
+        :type tail: int
+
+        :return: Path of the dump of each hart
+
+        :rtype: dict
+    '''
+    compression = dump_compression(dump)
+    suffix = ''
+    for dump_suffix, dump_compressed in dump_suffixes.items():
+        if dump_compressed == compression:
+            suffix = dump_suffix
+
+    def open_hart(hart):
+        paths[hart] = os.path.join(out_dir,
+                                   '{0}_{1}.dump{2}'.format(name, hart, suffix))
+        if compression is None:
+            return open(paths[hart], 'wb')
+        return DumpWriter(paths[hart])
+
+    paths = {}
+    files = {}
+    hart = None
+    pending = []
+    try:
+        with open_dump(dump) as f:
+            for line in skip_records(f, head, tail):
+                match = hart_regex.search(line)
+                if match:
+                    hart = int(match.group(1))
+                elif hart is None:
+                    pending.append(line)
+                    continue
+                out = files.get(hart)
+                if out is None:
+                    out = files[hart] = open_hart(hart)
+                if pending:
+                    out.write(b''.join(pending))
+                    pending = []
+                out.write(line)
+        if pending:
+            # A dump without records is kept whole as the dump of hart 0
+            out = files[0] = open_hart(0)
+            out.write(b''.join(pending))
+    finally:
+        for out in files.values():
+            out.close()
+    return paths
+
+
+def compare_harts(file1, file2, skip=None):
+    '''
+        Function to compare multi-hart dumps hart by hart. The dumps are
+        split by coreid in one pass, which finds the harts, and the dumps of
+        the harts are compared in parallel with :py:func:`compare_dumps`, so
+        that the order in which the harts were scheduled does not matter.
+        Dumps whose first block has records of one hart are first compared
+        whole, and are only split when they do not match and the DuT dump
+        has a hart which starts late. The dumps of the harts are compressed
+        like the dumps, and kept in the .harts directory next to the DuT dump
+        when a hart fails, for the paths in the log.
+
+        :param file1: The path to the DuT dump
+        :param file2: The path to the reference dump
+        :param skip: Records skipped at the head and tail of each dump
+        :type file1: str
+        :type file2: str
+        :type skip: dict
+        :return: Result, log and number of records like compare_dumps,
+            followed by the result, log and number of records of each hart
+            (None for a single hart)
+        :rtype: tuple
+    '''
+    if not skip or not any(skip.values()):
+        lines = _digests_match(file1, file2)
+        if lines is not None:
+            return 'Passed', '', lines, None
+    whole = None
+    if len(dump_harts(file1)) < 2:
+        whole = compare_dumps(file1, file2, skip)
+        if whole[0] == 'Passed' or not multi_hart(file1):
+            return whole + (None, )
+    skip = skip or {}
+    out_dir = os.path.join(os.path.dirname(os.path.abspath(file1)), '.harts')
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    keep = False
+    try:
+        dut_harts = split_dump(file1, out_dir, 'dut', skip.get('dut_head', 0),
+                               skip.get('dut_tail', 0))
+        ref_harts = split_dump(file2, out_dir, 'ref', skip.get('ref_head', 0),
+                               skip.get('ref_tail', 0))
+        all_harts = sorted(set(dut_harts) | set(ref_harts))
+        if whole is not None and len(all_harts) < 2:
+            return whole + (None, )
+
+        def compare(hart):
+            if hart not in dut_harts:
+                return 'Failed', f'{file1} has no records of hart {hart}', 0
+            if hart not in ref_harts:
+                return 'Failed', f'{file2} has no records of hart {hart}', \
+                    count_lines(dut_harts[hart])
+            return compare_dumps(dut_harts[hart], ref_harts[hart])
+
+        with ThreadPoolExecutor(max_workers=len(all_harts)) as executor:
+            results = dict(zip(all_harts, executor.map(compare, all_harts)))
+        keep = any(result[0] != 'Passed' for result in results.values())
+    finally:
+        if not keep:
+            shutil.rmtree(out_dir)
+    status = 'Passed'
+    rout = ''
+    count = 0
+    hart_results = {}
+    for hart, (hart_status, hart_rout, hart_count) in results.items():
+        hart_results[hart] = {
+            'result': hart_status,
+            'log': hart_rout,
+            'num_instr': hart_count
+        }
+        count += hart_count
+        if hart_status != 'Passed':
+            status = 'Failed'
+            rout += f'\nhart {hart}:\n{hart_rout}'
+    if keep:
+        rout += f'\nDumps of the harts are kept in {out_dir}'
+    return status, rout.lstrip('\n'), count, hart_results
+
+
+def compare_dumps(file1, file2, skip=None):
     '''
         Function to check whether two dump files are equivalent. This funcion ucore\s*(?P<coreid>\d):\s*(?P<priv>\d)\s*(?P<pc>.*?)\s+\((?P<instr>.*?)\)(?P<change>.*?)$ses the
         :param file1: The path to the first signature.
         :param file2: The path to the second signature.
+        :param skip: Records skipped at the head and tail of each dump, see
+            :py:func:`stream_compare_dumps`. None compares the whole dumps.
         :type file1: str
         :type file2: str
+        :type skip: dict
         :return: A string indicating whether the test "Passed" (if files are the same)
             or "Failed" (if the files are different) and the diff of the files.
     '''
     if not os.path.exists(file1) :
         logger.error('Signature file : ' + file1 + ' does not exist')
         raise SystemExit(1)
+    if skip is not None and any(skip.values()):
+        return stream_compare_dumps(file1, file2, skip)
+    lines = _digests_match(file1, file2)
+    if lines is not None:
+        return 'Passed', '', lines
+    # diff reads only plain files
+    if dump_compression(file1) or dump_compression(file2):
+        return stream_compare_dumps(file1, file2, skip or {})
+
     cmd = f'diff -iw {file1} {file2}'
     errcode, rout, rerr = sys_command(cmd, logging=False)
 
@@ -67,11 +1217,23 @@ def compare_dumps(file1, file2):
         # initial status
         status = 'Passed'
 
-        # get lines that start with < or >
-        mismatch_str_lst = list(filter(lambda x: x[0] in ['<', '>'], rout.split('\n')))
+        # get lines that start with < or >, with their line numbers in the
+        # dumps counted from the start of their hunk
+        mismatch_str_lst = []
+        mismatch_line_lst = []
+        line_numbers = {'<': 0, '>': 0}
+        for diff_line in rout.split('\n'):
+            hunk = hunk_regex.match(diff_line)
+            if hunk:
+                line_numbers = {'<': int(hunk.group(1)), '>': int(hunk.group(2))}
+            elif diff_line[:1] in ('<', '>'):
+                mismatch_str_lst.append(diff_line)
+                mismatch_line_lst.append(line_numbers[diff_line[0]])
+                line_numbers[diff_line[0]] += 1
 
         # for each mismatched strings
         start_val = -1
+        failed_lines = None
         for i in range(len(mismatch_str_lst)):
             
             file1_str = mismatch_str_lst[i]
@@ -86,45 +1248,26 @@ def compare_dumps(file1, file2):
                 else:
                     start_val = j
 
-                # get regex strings
-                try:
-                    file1_dat = dump_regex.findall(file1_str)[0]
-                    file2_dat = dump_regex.findall(file2_str)[0]
-                except IndexError:
-                    status = 'Failed'
+                mismatch = compare_records(file1_str, file2_str)
+                if mismatch is None:
                     break
-
-                # ensure commit message exists in same line number else fail
-                # if any of coreid, priv, pc or instr encoding fails, the diff has failed
-                if file1_dat[0:3] != file2_dat[0:3]:
-                    rout = rout + f'\nBM: {file1} at PC: {file1_dat[2]} and {file2} at PC: {file2_dat[2]}'
-                    status = 'Failed'
-                else:
-
-                    # some cleanup
-                    change1 = file1_dat[-1].split() 
-
-                    # if odd number, it's a store
-                    if len(change1) % 2:
-                        change1.remove('mem')
-
-                    # check if the architectural change is the same
-                    file1dat_iter = iter(change1)
-                    file2dat_iter = iter(file2_dat[-1].split())
-
-                    file1_change = dict(zip(file1dat_iter, file1dat_iter))
-                    file2_change = dict(zip(file2dat_iter, file2dat_iter))
-
-                    if file1_change != file2_change:
-                        rout = rout + f'\nSM: at PC: {file1_dat[2]}'
-                        status = 'Failed'
+                kind, file1_pc, file2_pc = mismatch
+                status = 'Failed'
+                if failed_lines is None:
+                    failed_lines = (mismatch_line_lst[i], mismatch_line_lst[j])
+                if kind == 'BM':
+                    rout = rout + f'\nBM: {file1} at PC: {file1_pc} and {file2} at PC: {file2_pc}'
+                elif kind == 'SM':
+                    rout = rout + f'\nSM: at PC: {file1_pc}'
                 break
+        if status == 'Failed':
+            # The window of the first records which failed the compare
+            rout += mismatch_window(file1, file2, *failed_lines)
     else:
         status = 'Passed'
     
     # get number of instructions executed
-    with open(f'{file1}','r') as fd:
-      rcount = len(fd.readlines())
+    rcount = count_lines(file1)
 
     return status, rout, rcount
     
@@ -147,8 +1290,7 @@ def compare_signature(file1, file2):
         status = 'Passed'
 
     # number of lines in the signature file
-    with open(f'{file1}','r') as fd:
-      rcount = len(fd.readlines())
+    rcount = count_lines(file1)
     
     return status, rout, rcount
 
@@ -179,7 +1321,7 @@ def save_yaml(data, out_file):
     """
     try:
         with open(out_file, 'w') as outfile:
-            ruamel.yaml.dump(data, outfile)
+            yaml.dump(data, outfile)
     except FileNotFoundError:
         logger.error("File doesn't exist")
 
@@ -210,7 +1352,466 @@ def check_isa(isa):
         logger.error(e)
       raise SystemExit(1)
 
-def sys_command(command, timeout=240, logging=True):
+def _reflink(src, dst):
+    with open(src, 'rb') as infile, open(dst, 'wb') as outfile:
+        try:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+        except OSError:
+            outfile.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst, link=True, hardlink=False):
+    """
+        Copy a file, sharing its data with the source when possible. A
+        reflink is tried first, then a hardlink when allowed and both are on
+        the same filesystem, and finally a regular copy. An existing
+        destination is replaced.
+
+        :param src: File to copy
+
+        :param dst: Path of the copy
+
+        :param link: Allow reflinks, which share the data until either file is written
+
+        :param hardlink: Allow hardlinks. Hardlinked files are the same file as the source, so writing one changes the other.
+
+        :type src: str
+
+        :type dst: str
+
+        :type link: bool
+
+        :type hardlink: bool
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link:
+        devices = (os.stat(src).st_dev,
+                   os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+        if fcntl is not None and _reflink_devices.get(devices, True):
+            try:
+                _reflink(src, dst)
+                _reflink_devices[devices] = True
+                return
+            except OSError:
+                _reflink_devices[devices] = False
+        if hardlink and devices[0] == devices[1]:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                pass
+    shutil.copy2(src, dst)
+
+
+def copy_tree(src, dst, link=True, hardlink=False):
+    """
+        Copy a directory into dst, like ``cp -r -f``, with the files copied
+        by :func:`link_or_copy`. Symlinks are copied as symlinks.
+
+        :param src: Directory to copy
+
+        :param dst: Destination directory, created when missing
+
+        :param link: Allow reflinks
+
+        :param hardlink: Allow hardlinks
+
+        :type src: str
+
+        :type dst: str
+
+        :type link: bool
+
+        :type hardlink: bool
+    """
+    for root, dirs, files in os.walk(src):
+        dest_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(dest_root, exist_ok=True)
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            dest_path = os.path.join(dest_root, name)
+            if os.path.islink(src_path):
+                if os.path.lexists(dest_path):
+                    os.remove(dest_path)
+                os.symlink(os.readlink(src_path), dest_path)
+            elif name in files:
+                link_or_copy(src_path, dest_path, link, hardlink)
+
+
+def file_digest(file):
+    """
+        SHA-1 digest of the contents of a file.
+
+        :param file: Path of the file
+
+        :type file: str
+
+        :returns: Hex digest
+
+        :rtype: str
+    """
+    digest = hashlib.sha1()
+    with open(file, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_elf(elf_file, symbols=None):
+    """
+        Read the metadata of an ELF file. Only the ELF header, the section
+        headers and the symbol table are parsed.
+
+        :param elf_file: Path of the ELF file
+
+        :param symbols: Names of the symbols to look up, elf_index_symbols when None
+
+        :type elf_file: str
+
+        :type symbols: list
+
+        :returns: Entry point, sections as [address, size], values of the symbols found, SHA-1 of the file and its size and mtime
+
+        :rtype: dict
+    """
+    wanted = {
+        name.encode() for name in (elf_index_symbols if symbols is None else symbols)
+    }
+    with open(elf_file, 'rb') as elf:
+        stat = os.fstat(elf.fileno())
+        data = elf.read()
+    if len(data) < 16 or data[:4] != b'\x7fELF':
+        raise ValueError('{0} is not an ELF file'.format(elf_file))
+    is_64 = data[4] == 2
+    endian = '<' if data[5] == 1 else '>'
+    if is_64:
+        header = struct.unpack_from(endian + 'HHIQQQIHHHHHH', data, 16)
+        section_format = endian + 'IIQQQQIIQQ'
+        symbol_format = endian + 'IBBHQQ'
+    else:
+        header = struct.unpack_from(endian + 'HHIIIIIHHHHHH', data, 16)
+        section_format = endian + 'IIIIIIIIII'
+        symbol_format = endian + 'IIIBBH'
+    entry, shoff, shentsize, shnum, shstrndx = (header[3], header[5],
+                                               header[10], header[11],
+                                               header[12])
+    # name, type, flags, addr, offset, size, link, ...
+    headers = [
+        struct.unpack_from(section_format, data, shoff + index * shentsize)
+        for index in range(shnum)
+    ]
+
+    def string(table, offset):
+        start = table[4] + offset
+        return data[start:data.index(b'\0', start)]
+
+    sections = {}
+    if shstrndx < shnum:
+        for section in headers:
+            name = string(headers[shstrndx], section[0]).decode()
+            if name:
+                sections[name] = [section[3], section[5]]
+    values = {}
+    symbol_size = struct.calcsize(symbol_format)
+    for section in headers:
+        # SHT_SYMTAB
+        if section[1] != 2:
+            continue
+        end = section[4] + section[5] - section[5] % symbol_size
+        for symbol in struct.iter_unpack(symbol_format,
+                                         data[section[4]:end]):
+            name = string(headers[section[6]], symbol[0])
+            if name in wanted:
+                values[name.decode()] = symbol[4] if is_64 else symbol[1]
+    return {
+        'entry': entry,
+        'sections': sections,
+        'symbols': values,
+        'sha1': hashlib.sha1(data).hexdigest(),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns
+    }
+
+
+def build_elf_index(work_dir):
+    """
+        Write the ELF index of a work_dir, with the metadata from
+        :func:`read_elf` of each ELF file in it.
+
+        :param work_dir: Work directory of a test
+
+        :type work_dir: str
+
+        :returns: The index, keyed by the ELF file name
+
+        :rtype: dict
+    """
+    index = {}
+    for entry in os.scandir(work_dir):
+        if entry.name.endswith('.elf') and entry.is_file():
+            try:
+                index[entry.name] = read_elf(entry.path)
+            except (ValueError, struct.error) as err:
+                logger.debug('Skipping {0}: {1}'.format(entry.path, err))
+    with open(os.path.join(work_dir, elf_index_file + '.tmp'), 'w') as outfile:
+        json.dump(index, outfile)
+    os.replace(os.path.join(work_dir, elf_index_file + '.tmp'),
+               os.path.join(work_dir, elf_index_file))
+    return index
+
+
+def build_elf_indexes(test_dict, process_count=None):
+    """
+        Write the ELF index of the work_dir of each test in parallel.
+
+        :param test_dict: Test list
+
+        :param process_count: Number of threads, chosen by the executor when None
+
+        :type test_dict: dict
+
+        :type process_count: int
+
+        :returns: Number of ELF files indexed
+
+        :rtype: int
+    """
+    work_dirs = list(
+        dict.fromkeys(attr['work_dir'] for attr in test_dict.values()))
+
+    def build(work_dir):
+        try:
+            return len(build_elf_index(work_dir))
+        except OSError as err:
+            logger.debug('No ELF index for {0}: {1}'.format(work_dir, err))
+            return 0
+
+    with ThreadPoolExecutor(max_workers=process_count) as executor:
+        return sum(executor.map(build, work_dirs))
+
+
+def elf_info(elf_file):
+    """
+        Metadata of an ELF file from the ELF index of its directory. The ELF
+        is read, and the index updated, only when the index is missing or
+        older than the ELF.
+
+        :param elf_file: Path of the ELF file
+
+        :type elf_file: str
+
+        :returns: Metadata as returned by :func:`read_elf`
+
+        :rtype: dict
+    """
+    work_dir, name = os.path.split(os.path.abspath(elf_file))
+    stat = os.stat(elf_file)
+    index_path = os.path.join(work_dir, elf_index_file)
+    try:
+        with open(index_path, 'r') as infile:
+            info = json.load(infile).get(name)
+        if info and (info['size'], info['mtime']) == (stat.st_size,
+                                                      stat.st_mtime_ns):
+            return info
+    except (OSError, ValueError):
+        pass
+    try:
+        return build_elf_index(work_dir)[name]
+    except (OSError, KeyError):
+        # The directory may not be writable
+        return read_elf(elf_file)
+
+
+def elf_symbol(elf_file, name):
+    """
+        Value of a symbol of an ELF file from its ELF index.
+
+        :param elf_file: Path of the ELF file
+
+        :param name: One of elf_index_symbols
+
+        :type elf_file: str
+
+        :type name: str
+
+        :returns: The value, None when the ELF does not have the symbol
+
+        :rtype: int
+    """
+    return elf_info(elf_file)['symbols'].get(name)
+
+def kill_process_group(process, sig=signal.SIGTERM):
+    '''
+        Function to terminate a process started in a new session along with
+        the processes it spawned.
+
+        :param process: The process, started with start_new_session
+
+        :param sig: The signal sent to the process group
+
+        :type process: subprocess.Popen
+
+        :type sig: int
+    '''
+    # The process leads its own group, whose id stays valid after the
+    # leader is reaped while the rest of the group runs
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        # The group has already exited
+        pass
+
+
+class DumpMonitor():
+    '''
+        Checks the records which a running DuT appends to its dump against
+        the finished dump of the reference model. Passed as the monitor of
+        :py:func:`sys_command`, it ends the simulation of a test at its first
+        mismatch instead of its instruction limit or timeout.
+
+        The records skipped by the compare are skipped here as well, so a
+        mismatch is what the compare of the complete dumps would find. The
+        DuT is also stopped when it commits more records than the reference
+        dump holds, past the records skipped at its end.
+
+        :param dut_dump: Dump written by the DuT while it runs
+
+        :param ref_dump: Dump of the reference model
+
+        :param skip: Records skipped at the head and tail of each dump, see
+            :py:func:`test_skip`
+
+        :type dut_dump: str
+
+        :type ref_dump: str
+
+        :type skip: dict
+    '''
+
+    def __init__(self, dut_dump, ref_dump, skip=None):
+        self.dut_dump = dut_dump
+        self.ref_dump = ref_dump
+        self.skip = skip or {}
+        self.offset = 0
+        self.partial = b''
+        self.count = 0
+        self.done = False
+        self._ref = None
+        # DuT records read, and reference records left to compare
+        self._records = 0
+        self._ref_left = 0
+
+    def _open_ref(self):
+        self._ref_left = count_lines(self.ref_dump) - self.skip.get(
+            'ref_head', 0) - self.skip.get('ref_tail', 0)
+        self._ref = open_dump(self.ref_dump, 'r')
+        for _ in range(self.skip.get('ref_head', 0)):
+            self._ref.readline()
+
+    def _check(self, record):
+        self._records = self._records + 1
+        if self._records <= self.skip.get('dut_head', 0):
+            return None
+        if self._ref_left <= 0:
+            # The records at the end of the DuT dump which the compare skips
+            if self._records - self.skip.get('dut_head', 0) - self.count <= \
+                    self.skip.get('dut_tail', 0):
+                return None
+            return 'DuT ran past the end of {0} at record {1} of {2}'.format(
+                self.ref_dump, self.count + 1, self.dut_dump)
+        ref_record = self._ref.readline()
+        self._ref_left = self._ref_left - 1
+        mismatch = compare_records(record, ref_record)
+        if mismatch is None:
+            self.count = self.count + 1
+            return None
+        kind, dut_pc, ref_pc = mismatch
+        message = 'Divergence at record {0} of {1}'.format(
+            self.count + 1, self.dut_dump)
+        if kind == 'BM':
+            message += f'\nBM: DuT at PC: {dut_pc} and REF at PC: {ref_pc}'
+        elif kind == 'SM':
+            message += f'\nSM: at PC: {dut_pc}'
+        message += '\n< ' + record.rstrip() + '\n> ' + ref_record.rstrip()
+        return message
+
+    def __call__(self):
+        '''
+            Function to check the records appended since the last call.
+
+            :return: Description of the first mismatch, None when the records match
+
+            :rtype: str
+        '''
+        if self.done:
+            return None
+        try:
+            dump = open(self.dut_dump, 'rb')
+        except FileNotFoundError:
+            return None
+        if self._ref is None:
+            self._open_ref()
+        with dump:
+            dump.seek(self.offset)
+            for block in iter(lambda: dump.read(read_size), b''):
+                self.offset += len(block)
+                lines = (self.partial + block).split(b'\n')
+                self.partial = lines.pop()
+                for line in lines:
+                    message = self._check(line.decode(errors='replace'))
+                    if message is not None:
+                        self.done = True
+                        self.close()
+                        return message
+        return None
+
+    def close(self):
+        '''
+            Function to close the reference dump.
+        '''
+        if self._ref is not None:
+            self._ref.close()
+            self._ref = None
+
+
+def dump_monitor(attr, since, dut_dump=None):
+    '''
+        Function to get the monitor which a DuT plugin passes to
+        :py:func:`sys_command` to stop the simulation of a test at its first
+        divergence from the reference. river_core compile runs the reference
+        plugins first when kill_on_divergence is set, and gives the DuT
+        plugins the time they started as ref_dumps_since in their ini_config.
+
+        :param attr: The test list entry of the test
+
+        :param since: Time from which the reference dumps are of this run,
+            older ones are not used
+
+        :param dut_dump: Dump the DuT writes while it runs, by default
+            dut.dump in the work_dir of the test
+
+        :type attr: dict
+
+        :type since: float
+
+        :type dut_dump: str
+
+        :return: The monitor, None when the test has no reference dump of this run
+
+        :rtype: DumpMonitor
+    '''
+    ref_dump = find_dump(os.path.join(attr['work_dir'], 'ref.dump'))
+    if ref_dump is None or os.stat(ref_dump).st_mtime < since:
+        return None
+    return DumpMonitor(dut_dump or os.path.join(attr['work_dir'], 'dut.dump'),
+                       ref_dump, test_skip(attr, raw=True))
+
+
+def sys_command(command, timeout=240, logging=True, monitor=None,
+                monitor_interval=1):
     '''
         Wrapper function to run shell commands with a timeout.
         Uses :py:mod:`subprocess`, :py:mod:`shlex`, :py:mod:`os`
@@ -220,11 +1821,22 @@ def sys_command(command, timeout=240, logging=True):
 
         :param timeout: The value after which the framework exits. Default set to configured to 240 seconds
 
+        :param monitor: Callable polled while the command runs, like a
+            :py:class:`DumpMonitor`. The command is killed when it returns a
+            message.
+
+        :param monitor_interval: Seconds between the polls of the monitor
+
         :type command: list
 
         :type timeout: int
 
-        :returns: Error Code (int) ; STDOUT ; STDERR
+        :type monitor: callable
+
+        :type monitor_interval: float
+
+        :returns: Error Code (int) ; STDOUT ; STDERR. A command killed by the
+            monitor returns 1 ; message of the monitor ; "DivergenceDetected"
 
         :rtype: list
     '''
@@ -237,16 +1849,36 @@ def sys_command(command, timeout=240, logging=True):
                           stderr=subprocess.PIPE,
                           start_new_session=True) as process:
         try:
-            out, err = process.communicate(timeout=timeout)
+            if monitor is None:
+                out, err = process.communicate(timeout=timeout)
+            else:
+                deadline = time.monotonic() + timeout
+                while True:
+                    try:
+                        out, err = process.communicate(timeout=min(
+                            monitor_interval,
+                            max(deadline - time.monotonic(), 0)))
+                        break
+                    except subprocess.TimeoutExpired:
+                        if time.monotonic() >= deadline:
+                            raise
+                    message = monitor()
+                    if message is not None:
+                        kill_process_group(process)
+                        process.kill()
+                        process.communicate()
+                        logger.error('Process Killed')
+                        logger.error(message)
+                        return 1, message, "DivergenceDetected"
             out = out.rstrip()
             err = err.rstrip()
         except subprocess.TimeoutExpired:
+            # Children holding the pipes open would block the communicate
+            kill_process_group(process)
             process.kill()
             out, err = process.communicate()
             out = out.rstrip()
             err = err.rstrip()
-            pgrp = os.getpgid(process.pid)
-            os.killpg(pgrp, signal.SIGTERM)
             logger.error('Process Killed')
             logger.error("Command did not exit within {0} seconds: {1}".format(timeout,command))
             return 1, "GuruMeditation", "TimeoutExpired"